@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+End to end benchmark of the API against a local fake StartSSL server (see fake_server.py).
+
+Times get_certificates_list(), get_certificate(), CSR parsing and submit_certificate_request()
+and reports throughput and latency percentiles. Use --json to store the results for later comparison.
+
+Usage: python benchmarks/bench_api.py [--pages N] [--rows N] [--latency SECONDS] [--count N] [--jobs N] [--json FILE]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import startssl
+import synthetic
+from fake_server import FakeStartSSL
+
+
+def percentile(values, p):
+    """
+    p-th percentile (nearest rank) of sorted values
+    """
+    if not values:
+        return None
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def measure(name, operation, count, items=1):
+    """
+    Runs operation count times and returns the statistics
+
+    :param items: number of items (e.g. certificates) processed per operation, used for the throughput
+    """
+    latencies = []
+    start = time.time()
+    for _ in range(count):
+        op_start = time.time()
+        operation()
+        latencies.append(time.time() - op_start)
+    total = time.time() - start
+    latencies.sort()
+    return {
+        'name': name,
+        'operations': count,
+        'items': count * items,
+        'total_s': total,
+        'items_per_s': count * items / total if total else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def print_results(results):
+    print("%-36s %6s %8s %9s %12s %9s %9s %9s %9s" % ("benchmark", "ops", "items", "total s", "items/s",
+                                                      "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for r in results:
+        print("%-36s %6d %8d %9.3f %12.1f %9.2f %9.2f %9.2f %9.2f" % (
+            r['name'], r['operations'], r['items'], r['total_s'], r['items_per_s'],
+            r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the API against a local fake StartSSL server.")
+    parser.add_argument('--pages', default=10, type=int, help="CertList pages (default: %(default)s)")
+    parser.add_argument('--rows', default=100, type=int, help="certificates per CertList page (default: %(default)s)")
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help="simulated server latency per response in seconds (default: %(default)s)")
+    parser.add_argument('--error_rate', default=0.0, type=float,
+                        help="share of the requests the server refuses with 503, they are retried (default: %(default)s)")
+    parser.add_argument('--count', default=50, type=int,
+                        help="operations per benchmark (default: %(default)s)")
+    parser.add_argument('--jobs', default=4, type=int,
+                        help="concurrency for the concurrent download benchmark (default: %(default)s)")
+    parser.add_argument('--json', default=None, type=str, help="write the results to this JSON file")
+    parser.add_argument('--stats', action='store_true',
+                        help="print the request statistics (latency, bytes, connection reuse per endpoint)")
+    args = parser.parse_args()
+
+    server = FakeStartSSL(pages=args.pages, rows_per_page=args.rows, latency=args.latency,
+                         error_rate=args.error_rate).start()
+    api = server.configure(startssl.API(ca_certs=None, connections=args.jobs))
+    metrics = startssl.Metrics()
+    if args.stats:
+        api.add_request_hook(metrics)
+    api.authenticate(__file__, __file__)  # the client certificate isn't used over plain HTTP
+
+    certificates = args.pages * args.rows
+    ids = [synthetic.certificate_id(order_number) for order_number in range(args.count)]
+    list_runs = max(1, args.count // 10)
+
+    def list_certificates(prefetch=0):
+        listed = sum(1 for _ in api.get_certificates_list(prefetch=prefetch))
+        assert listed == certificates, listed
+
+    ids_iter = iter(ids * 2)
+
+    def download():
+        basename, cert, intermediate_cert = api.get_certificate(next(ids_iter))
+
+    def download_concurrent():
+        for cert, result, error in api.get_certificates([{'id': id} for id in ids], jobs=args.jobs):
+            assert error is None, error
+
+    def submit():
+        api.submit_certificate_request('server', startssl.CSR(synthetic.CSR))
+
+    api.get_validated_resources()
+    results = [
+        measure("get_certificates_list", list_certificates, list_runs, certificates),
+        measure("get_certificates_list(prefetch=1)", lambda: list_certificates(1), list_runs, certificates),
+        measure("get_certificate", download, args.count),
+        measure("get_certificates(jobs=%d)" % args.jobs, download_concurrent, 1, args.count),
+        measure("CSR", lambda: startssl.CSR(synthetic.CSR), args.count),
+        measure("submit_certificate_request", submit, args.count),
+    ]
+    server.stop()
+
+    print("fake server: %d pages x %d certificates, %.1f ms latency, %d requests (%d refused), %d KiB sent" % (
+        args.pages, args.rows, args.latency * 1000, server.requests, server.errors, server.bytes_sent // 1024))
+    print_results(results)
+    if args.stats:
+        print()
+        print(metrics.summary())
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Compares the streaming CertList parser with the regex based parser it replaced.
+
+Usage: python benchmarks/bench_certlist_parser.py [rows per page ...]
+"""
+
+from __future__ import print_function
+
+import datetime
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import startssl
+import synthetic
+
+# the former API.RETRIEVE_CERTIFICATE_LIST (the inline (?s) is written as [\s\S], python >= 3.11 rejects it mid-pattern)
+RETRIEVE_CERTIFICATE_LIST = re.compile(
+    r'<tr style="text-align:center;">\s+<td style="vertical-align:middle;">(?P<order_number>\d+)</td>\s+<td align="left" style="vertical-align:middle;" title="(?P<name>.+?)">.+?</td>\s+<td align="left" style="vertical-align:middle;">(?P<product>[\w ]+?)</td>\s+<td style="vertical-align:middle;">\s*(?:<span>)?(?P<issuance_date_year>\d{4})?-?(?P<issuance_date_month>\d{2})?-?(?P<issuance_date_day>\d{2})?(?:</span><br /><span>)?(?P<expiry_date_year>\d{4})?-?(?P<expiry_date_month>\d{2})?-?(?P<expiry_date_day>\d{2})?(?:</span>)?\s*</td>\s+<td style="vertical-align:middle;">\s+(?P<status>.+?)<!--.*?-->\s+</td>\s+<td align="center" style="vertical-align:middle;">\s*(?P<actions_code>[\s\S]*?)\s*</td>\s*</tr>',
+    re.UNICODE)
+RETRIEVE_CERTIFICATE_LIST_ACCTION_ID = re.compile(r'orderId=(?P<orderId>\w+)')
+
+CHUNK_SIZE = 16384
+
+
+def parse_regex(content):
+    """
+    The former API.get_certificates_list() page parsing
+    """
+    certificates = []
+    for item in RETRIEVE_CERTIFICATE_LIST.finditer(content):
+        cert = item.groupdict()
+
+        if cert['issuance_date_year'] != None:
+            cert['issuance_date'] = datetime.date(int(cert['issuance_date_year']), int(cert['issuance_date_month']), int(cert['issuance_date_day']))
+            cert['expiry_date'] = datetime.date(int(cert['expiry_date_year']), int(cert['expiry_date_month']), int(cert['expiry_date_day']))
+        else:
+            cert['issuance_date'] = None
+            cert['expiry_date'] = None
+
+        cert['order_number'] = int(cert['order_number'])
+
+        if cert['product'].endswith("SSL"):
+            cert['profile'] = "server"
+        elif cert['product'].endswith("Client"):
+            cert['profile'] = "client"
+        elif cert['product'].endswith("Code Signing"):
+            cert['profile'] = "object"
+        else:
+            cert['profile'] = None
+
+        if cert['product'].startswith("Class"):
+            cert['class'] = int(cert['product'][6])
+        else:
+            cert['class'] = None
+
+        item = RETRIEVE_CERTIFICATE_LIST_ACCTION_ID.search(cert['actions_code'])
+        if item != None:
+            cert['id'] = item.group('orderId')
+        else:
+            cert['id'] = None
+        del cert['actions_code']
+
+        certificates.append(cert)
+    return certificates
+
+
+def parse_streaming(content):
+    parser = startssl.CertificateListParser()
+    parser.feed(content)
+    parser.close()
+    return parser.pop_certificates()
+
+
+def parse_streaming_chunked(content):
+    parser = startssl.CertificateListParser()
+    certificates = []
+    for offset in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[offset:offset + CHUNK_SIZE])
+        certificates.extend(parser.pop_certificates())
+    parser.close()
+    certificates.extend(parser.pop_certificates())
+    return certificates
+
+
+def same(certificates, expected):
+    """
+    Compares entries key by key (the regex entries are dicts, the streaming parser returns Certificate records)
+    """
+    return len(certificates) == len(expected) and all(
+        all(cert[key] == value for key, value in expected_cert.items())
+        for cert, expected_cert in zip(certificates, expected))
+
+
+def bench(function, content, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function(content)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [100, 1000, 10000]
+    print("%8s %10s %-24s %10s %12s" % ("rows", "page KiB", "parser", "best ms", "rows/s"))
+    for rows in sizes:
+        content = synthetic.certlist_page(0, rows, 1)
+        repeat = max(3, 30000 // rows)
+        expected = None
+        for name, function in [("regex", parse_regex), ("streaming", parse_streaming),
+                               ("streaming (16K chunks)", parse_streaming_chunked)]:
+            elapsed, certificates = bench(function, content, repeat)
+            if expected is None:
+                expected = certificates
+            assert same(certificates, expected) and len(certificates) == rows, "%s: parsed %d rows" % (name, len(certificates))
+            print("%8d %10d %-24s %10.2f %12.0f" % (rows, len(content) // 1024, name, elapsed * 1000, rows / elapsed))
+
+    # the regex depends on every detail of the markup, e.g. rows without the status comment are silently dropped
+    print()
+    print("page without status comments:")
+    print("%8s %10s %-24s %10s %12s" % ("rows", "page KiB", "parser", "best ms", "parsed rows"))
+    for rows in [size for size in sizes if size <= 1000]:
+        content = re.sub("<!--[^-]*-->", "", synthetic.certlist_page(0, rows, 1).replace("<!--Cert List-->", ""))
+        for name, function in [("regex", parse_regex), ("streaming", parse_streaming)]:
+            elapsed, certificates = bench(function, content, 1)
+            print("%8d %10d %-24s %10.2f %12d" % (rows, len(content) // 1024, name, elapsed * 1000, len(certificates)))
+
+
+if __name__ == "__main__":
+    main()
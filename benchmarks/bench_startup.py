@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+CLI startup benchmark: times complete startssl.py runs (interpreter start, imports, argument parsing, work)
+of --version, a certs listing and a csr submission against a local fake StartSSL server (see fake_server.py).
+
+The CLI runs in a fresh interpreter for each run, its URIs are pointed to the fake server by a small bootstrap
+which only imports sys, so the import costs are measured as in production.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--json FILE]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import synthetic
+from bench_api import measure, print_results
+from fake_server import FakeStartSSL
+
+STARTSSL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "startssl.py")
+
+BOOTSTRAP = """
+import sys
+path, base_uri = sys.argv[1:3]
+source = open(path).read()
+source = source.replace('"https://auth.startssl.com"', repr(base_uri + "/")).replace('"https://startssl.com', '"' + base_uri)
+sys.argv = [path] + sys.argv[3:]
+exec(compile(source, path, 'exec'), sys.modules['__main__'].__dict__)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the startup of the CLI.")
+    parser.add_argument('--runs', default=10, type=int, help="runs per command (default: %(default)s)")
+    parser.add_argument('--json', default=None, type=str, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = FakeStartSSL(pages=1, rows_per_page=20).start()
+    workdir = tempfile.mkdtemp()  # no startssl.conf
+    csr_file = os.path.join(workdir, "www.example.com.csr")
+    with open(csr_file, 'w') as f:
+        f.write(synthetic.CSR)
+    credentials = ['--client_crt', csr_file, '--client_key', csr_file, '--ca_certs', csr_file]
+
+    def run(command):
+        subprocess.check_call(command, cwd=workdir, stdout=open(os.devnull, 'w'))
+
+    def cli(*cli_args):
+        return [sys.executable, "-c", BOOTSTRAP, STARTSSL, server.base_uri] + credentials + list(cli_args)
+
+    try:
+        results = [
+            measure("python (interpreter only)", lambda: run([sys.executable, "-c", "pass"]), args.runs),
+            measure("startssl.py --version", lambda: run([sys.executable, STARTSSL, "--version"]), args.runs),
+            measure("startssl.py certs", lambda: run(cli("certs")), args.runs),
+            measure("startssl.py csr", lambda: run(cli("csr", csr_file)), args.runs),
+        ]
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Local stand-in for the StartSSL server, used by the benchmarks.
+
+Serves the client certificate login, synthetic CertList pages, the validated domains/emails JSON endpoints,
+DownLoadCert zip bundles and the CSR submission (POST + redirect) flow over plain HTTP on 127.0.0.1.
+HTML pages are gzip compressed if the client accepts it. A share of the requests can be refused with
+503 Service Unavailable (error_rate) to exercise the retries.
+"""
+
+import random
+import socket
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # python 3
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+import synthetic
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class FakeStartSSLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately, don't let Nagle + delayed ACKs add 40ms to each response
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=()):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if content_type.startswith("text/") and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip_compress(body)
+            headers = list(headers) + [("Content-Encoding", "gzip")]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            status, body, headers = 503, b"", [("Retry-After", "0")]
+            self.server.errors += 1
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests += 1
+        self.server.bytes_sent += len(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        self.read_body()  # the validated resources requests are GETs with a body
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+
+        if url.path == "/":
+            return self.send(302, headers=[("Location", "https://Startssl.com/ControlPanel"),
+                                           ("Set-Cookie", "MyStartSSLCookie=benchmark; path=/")])
+        if url.path == "/ControlPanel/AjaxRequestGetAllDomainValis":
+            return self.send(200, synthetic.validated_domains_json(), "application/json")
+        if url.path == "/ControlPanel/AjaxRequestGetAllEmailValis":
+            return self.send(200, synthetic.validated_emails_json(), "application/json")
+        if url.path == "/CertList":
+            pageindex = int(query["pageindex"][0])
+            return self.send(200, synthetic.certlist_page(pageindex, server.rows_per_page, server.pages))
+        if url.path == "/CertList/DownLoadCert":
+            order_number = int(query["orderId"][0][2:])
+            name = synthetic.certificate_name(order_number)
+            return self.send(200, server.bundle(name), "application/octet-stream",
+                             [("Content-Disposition", "attachment; filename=%s.zip" % name)])
+        if url.path == "/Certificates/ssl/second_step_certs":
+            return self.send(200, "<html>second step</html>")
+        self.send(404, "not found")
+
+    def do_POST(self):
+        self.read_body()
+        self.server.posts.append(urlsplit(self.path).path)
+        if urlsplit(self.path).path == "/Certificates/ssl":
+            return self.send(302, headers=[("Location", "/Certificates/ssl/second_step_certs")])
+        self.send(404, "not found")
+
+
+class FakeStartSSL(ThreadingMixIn, HTTPServer):
+    """
+    Threaded fake StartSSL server, run it with start() and point API instances to it with configure().
+    """
+    daemon_threads = True
+
+    def __init__(self, pages=10, rows_per_page=100, latency=0.0, error_rate=0.0):
+        """
+        :param pages: number of CertList pages
+        :param rows_per_page: certificates per CertList page
+        :param latency: seconds each response is delayed (simulated network/server latency)
+        :param error_rate: share of the requests refused with 503 Service Unavailable
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeStartSSLHandler)
+        self.pages = pages
+        self.rows_per_page = rows_per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.posts = []  # paths of the POST requests
+        self.bundles = {}
+
+    @property
+    def base_uri(self):
+        return "http://127.0.0.1:%d" % self.server_port
+
+    def bundle(self, name):
+        bundle = self.bundles.get(name)
+        if bundle is None:
+            bundle = self.bundles[name] = synthetic.certificate_bundle(name)
+        return bundle
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def configure(self, api):
+        """
+        Points an API (or AsyncAPI) instance to this server
+        """
+        api.STARTSSL_BASEURI = self.base_uri
+        api.STARTSSL_AUTHURI = self.base_uri + "/"
+        api.STARTSSL_GETDOMAINSURI = self.base_uri + "/ControlPanel/AjaxRequestGetAllDomainValis"
+        api.STARTSSL_GETEMAILSURI = self.base_uri + "/ControlPanel/AjaxRequestGetAllEmailValis"
+        api.STARTSSL_SUBMITCSR = self.base_uri + "/Certificates/ssl"
+        return api
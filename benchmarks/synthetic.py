@@ -0,0 +1,148 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Synthetic StartSSL responses for the benchmarks.
+"""
+
+import io
+import json
+import zipfile
+
+PRODUCTS = ["Class 1 SSL", "Class 2 SSL", "Class 2 Client", "Class 2 Code Signing"]
+
+CERTLIST_ROW = """<tr style="text-align:center;">
+    <td style="vertical-align:middle;">{order_number}</td>
+    <td align="left" style="vertical-align:middle;" title="{name}">{name}</td>
+    <td align="left" style="vertical-align:middle;">{product}</td>
+    <td style="vertical-align:middle;">
+        {dates}
+    </td>
+    <td style="vertical-align:middle;">
+        {status}<!--{status}-->
+    </td>
+    <td align="center" style="vertical-align:middle;">
+        <a href="/CertList/DownLoadCert?orderId={id}" class="btn">Retrieve</a>
+        <a href="javascript:void(0);" onclick="revoke('{id}');">Revoke</a>
+    </td>
+</tr>
+"""
+
+CERTLIST_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>StartSSL</title></head>
+<body>
+<h2>Certificate List<!--Cert List--></h2>
+<table class="table">
+<tr><th>Order Number</th><th>Common Name</th><th>Product</th><th>Date</th><th>Status</th><th>Actions</th></tr>
+{rows}</table>
+{next_page}
+</body>
+</html>
+"""
+
+
+def certificate_name(order_number):
+    return "host%d.example.com" % order_number
+
+
+def certificate_id(order_number):
+    return "id%08d" % order_number
+
+
+def certlist_row(order_number):
+    """
+    Returns a CertList table row, every 10th order is still pending (no dates)
+    """
+    if order_number % 10 == 9:
+        dates = ""
+        status = "Pending"
+    else:
+        day = order_number % 28 + 1
+        dates = "<span>2016-01-%02d</span><br /><span>2017-01-%02d</span>" % (day, day)
+        status = "Issued"
+    return CERTLIST_ROW.format(order_number=order_number, name=certificate_name(order_number),
+                               product=PRODUCTS[order_number % len(PRODUCTS)], dates=dates, status=status,
+                               id=certificate_id(order_number))
+
+
+def certlist_page(pageindex, rows_per_page, pages):
+    """
+    Returns a CertList page, the newest orders are listed first (like StartSSL does)
+    """
+    total = rows_per_page * pages
+    first = total - pageindex * rows_per_page - 1
+    rows = "".join(certlist_row(order_number) for order_number in range(first, first - rows_per_page, -1))
+    next_page = ""
+    if pageindex + 1 < pages:
+        next_page = '<a href="/CertList?pageindex=%d">Next page</a>' % (pageindex + 1)
+    return CERTLIST_PAGE.format(rows=rows, next_page=next_page)
+
+
+VALIDATED_DOMAINS = ["example.com", "example.org", "example.net"]
+VALIDATED_EMAILS = ["hostmaster@example.com", "hostmaster@example.org"]
+
+# not a real certificate, the API only checks the PEM markers
+CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIIDazCCAlOgAwIBAgIUB7Z8m0vx8bQn1dW0bJvC0bD5Qm8wDQYJKoZIhvcNAQEL
+BQAwRTELMAkGA1UEBhMCQVUxEzARBgNVBAgMClNvbWUtU3RhdGUxITAfBgNVBAoM
+GEludGVybmV0IFdpZGdpdHMgUHR5IEx0ZDAeFw0xNjAxMDEwMDAwMDBaFw0xNzAx
+-----END CERTIFICATE-----
+"""
+
+# CN www.example.com, SubjectAltNames www.example.com, example.com, mail.example.com, api.example.org
+CSR = """-----BEGIN CERTIFICATE REQUEST-----
+MIIC2zCCAcMCAQAwOTELMAkGA1UEBhMCREUxEDAOBgNVBAoMB0V4YW1wbGUxGDAW
+BgNVBAMMD3d3dy5leGFtcGxlLmNvbTCCASIwDQYJKoZIhvcNAQEBBQADggEPADCC
+AQoCggEBAKVGjPAumGQrS2omoxeODVWMsWrK9qiqmuOn8vSStIEMH+YjkRwh1zDW
+Q4Euvw+IffTbKAxsOIy/dlzn0W4byl0iLYz9fz7bLUCM3ez62G3Rud7zU3Yg5+jr
+RXL1gJNvv/TRcBnckPTtyGpjpDSIKsxfXMclXAAph9Ia2cKIicushPNLWsHgnVMb
+KtA/GFjEm9d8N1oiuPxhLyE2m0c5knLNzEiDg9k4/X8VAvK24ihH1j4JJFhPIDJh
+wK69JhYC6bGhbizuwmoo4jmXpvKjHtA3l20NZl3vUHQIHBUMkW2zbFfgvX7D89H/
+ZGyl8tqkVd6JbiNjD7rdghiGnor5gNUCAwEAAaBdMFsGCSqGSIb3DQEJDjFOMEww
+SgYDVR0RBEMwQYIPd3d3LmV4YW1wbGUuY29tggtleGFtcGxlLmNvbYIQbWFpbC5l
+eGFtcGxlLmNvbYIPYXBpLmV4YW1wbGUub3JnMA0GCSqGSIb3DQEBCwUAA4IBAQAF
+QBxjl4PQZxUZE7fLJHscCtsJxbQrCRESod5+GTBXjDYAHOzmJPYSrLotWmi5JO+W
+mzRZxdJWZ9+vdBSsr4xLVY1XfOn1VTKUhGnHP0JnO/NAegPPrrmygL9m/+oaHas4
+S32vo+5ICG7HvHyBbxrbRRbgb5Wqiv0Ry/HgPpgDva1GmHdg9JvTP5gFl+e9+VRJ
+6djOCLLBoZ+Z/5d+WGjGAJmEuA8LoWT6f50llVKiXW28Lx/zBIbwyBn7ff9sNLP5
+tFd2FmRwrs4F+hiSRR8H0Hp/2ns0eTVa8GfMkqLoPB9OdHQLlP/kvWQTrEgxXkVs
+xqOXDNEHos4ApwC+ONqd
+-----END CERTIFICATE REQUEST-----
+"""
+
+# O NoCN, no common name and no SubjectAltNames
+CSR_WITHOUT_CN = """-----BEGIN CERTIFICATE REQUEST-----
+MIHIMHQCAQAwDzENMAsGA1UECgwETm9DTjBcMA0GCSqGSIb3DQEBAQUAA0sAMEgC
+QQC2sO51KpYZoPcJDquzyADNTlAH/HsQTARLS6v8W6surS6cluBtLbJqxkRrzF+z
++u4xY5ZjSeJUkA/Ktq8DEjo5AgMBAAGgADANBgkqhkiG9w0BAQsFAANBAJpqsSBw
+2liBBr+R4fjknNal7gWbuz472U8+LD1AowEpSgg/RG8HgpsVbnRtVA/q8mf8/i38
+aQH0iTKjaYfsR8I=
+-----END CERTIFICATE REQUEST-----
+"""
+
+
+def validated_domains_json():
+    return json.dumps([{'Domain': domain} for domain in VALIDATED_DOMAINS])
+
+
+def validated_emails_json():
+    return json.dumps([{'Email': email} for email in VALIDATED_EMAILS])
+
+
+def _zip(members):
+    data = io.BytesIO()
+    zf = zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED)
+    for name, content in members:
+        zf.writestr(name, content)
+    zf.close()
+    return data.getvalue()
+
+
+def certificate_bundle(name):
+    """
+    Returns a server certificate zip bundle like DownLoadCert (the certificates are nested in OtherServer.zip)
+    """
+    other_server = _zip([("1_Intermediate.crt", CERTIFICATE), ("2_%s.crt" % name, CERTIFICATE),
+                         ("3_Root.crt", CERTIFICATE)])
+    return _zip([("ApacheServer.zip", other_server), ("IISServer.zip", other_server),
+                 ("NginxServer.zip", other_server), ("OtherServer.zip", other_server)])
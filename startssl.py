@@ -8,6 +8,7 @@ Website: https://github.com/freddy36/StartSSL_API
 
 Dependencies:
   apt-get install python-httplib2 python-pyasn1 python3-pyasn1-modules
+  apt-get install python-concurrent.futures (python 2 only)
 
 Copyright (c) 2014, Frederik Kriewitz <frederik@kriewitz.eu>.
 
@@ -29,59 +30,255 @@ MA 02110-1301 USA
 
 from __future__ import print_function
 try:
-    from urllib.parse import urlencode  # python 3
+    from urllib.parse import urlencode, urlsplit  # python 3
 except ImportError:
     from urllib import urlencode  # python 2
+    from urlparse import urlsplit
+try:
+    import queue  # python 3
+except ImportError:
+    import Queue as queue  # python 2
+try:
+    from collections.abc import Mapping  # python 3
+except ImportError:
+    from collections import Mapping  # python 2
 
 __version__ = "1.05"
 
 import argparse
-import httplib2
+import atexit
 import re
 import datetime
+import errno
 import os
+import socket
+import string
 import sys
-import traceback
+import threading
+import time
+import collections
 
 import base64
-import pyasn1
-import pyasn1.codec.der.decoder
-import pyasn1_modules.rfc2314
-import pyasn1_modules.rfc2459
-
-import zipfile
+import bisect
 import io
-
 import json
-import uuid
 
+# Expensive or rarely needed modules (httplib2, pyasn1, zipfile, concurrent.futures, ...) are imported where
+# they are used, so each subcommand only loads what it needs (see benchmarks/bench_startup.py).
+
+
+class _LazyRegex(object):
+    """
+    Class attribute holding a regular expression which is compiled on first use.
+    The compiled regex then replaces the descriptor, so later lookups are plain attribute accesses.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __get__(self, instance, owner):
+        regex = re.compile(self.pattern, self.flags)
+        for cls in owner.__mro__:
+            for name, value in list(vars(cls).items()):
+                if value is self:
+                    setattr(cls, name, regex)
+        return regex
+
+
+def _atomic_write(path, data, mode=0o600):
+    """
+    Writes data to path atomically.
+    The data is written to a temporary file in the same directory which then replaces the target.
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        getattr(os, 'replace', os.rename)(tmp_path, path)  # os.replace is python 3 only
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class _FileLock(object):
+    """
+    Exclusive advisory lock (flock) on a lock file, shared by all processes using the same file.
+    Where fcntl isn't available (windows) the lock is a no-op.
+    """
 
-class CSR:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        try:
+            import fcntl
+        except ImportError:
+            return
+        f = open(self.path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        except Exception:
+            f.close()
+            raise
+        self.file = f
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()  # closing the file releases the lock
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class CSR(object):
     """
     Parses CSRs
+
+    The CSR is decoded once, the common name, subject, SubjectAltNames and public key fingerprint are cached.
     """
-    id_PKCS9_extensionRequest = pyasn1.type.univ.ObjectIdentifier('1.2.840.113549.1.9.14')
+    __slots__ = ('pem', 'filename', '_asn1', 'subject', 'common_name', 'subject_alt_names', 'public_key_fingerprint')
 
+    id_PKCS9_extensionRequest = (1, 2, 840, 113549, 1, 9, 14)
 
     def __init__(self, pem_csr):
+        self.filename = getattr(pem_csr, 'name', None)
         if 'read' in dir(pem_csr):
             pem_csr = pem_csr.read()
 
         self.pem = pem_csr
         self.__parse_pem()
 
-    def __parse_pem(self):
+    def __getstate__(self):
+        # the decoded ASN.1 structure is large and only needed on demand, don't pickle it
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__ if slot != '_asn1')
+
+    def __setstate__(self, state):
+        self._asn1 = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    @property
+    def asn1(self):
+        """
+        The decoded CertificationRequest
+        """
+        if self._asn1 is None:
+            self._asn1 = self.__decode_pem()
+        return self._asn1
+
+    def __decode_pem(self):
         """
-        Parses a PEM encoded CSR to asn1
+        Decodes a PEM encoded CSR to asn1
         """
         matches = re.search(
             "-----BEGIN CERTIFICATE REQUEST-----([A-Za-z0-9+/=\n\r\t ]*)-----END CERTIFICATE REQUEST-----", self.pem)
         if not matches:
             raise ValueError("Not a valid PEM CSR")
 
+        import pyasn1.codec.der.decoder
+        import pyasn1_modules.rfc2314
+
         csr_b64 = matches.group(1)
         csr_bin = base64.b64decode(csr_b64)
-        self.asn1, _ = pyasn1.codec.der.decoder.decode(csr_bin, asn1Spec=pyasn1_modules.rfc2314.CertificationRequest())
+        asn1, _ = pyasn1.codec.der.decoder.decode(csr_bin, asn1Spec=pyasn1_modules.rfc2314.CertificationRequest())
+        return asn1
+
+    def __parse_pem(self):
+        """
+        Parses a PEM encoded CSR (single pass) and caches the interesting parts
+        """
+        import hashlib
+        import pyasn1.codec.der.decoder
+        import pyasn1.codec.der.encoder
+        import pyasn1_modules.rfc2459
+
+        self._asn1 = self.__decode_pem()
+        request_info = self._asn1.getComponentByName('certificationRequestInfo')
+
+        self.subject = []
+        self.common_name = None
+        for rdn in request_info.getComponentByName('subject')[0]:
+            name = rdn[0]
+            oid = name.getComponentByName('type')
+            value = pyasn1.codec.der.decoder.decode(name.getComponentByName('value'))[0]
+            self.subject.append((str(oid), str(value)))
+            if oid == pyasn1_modules.rfc2459.id_at_commonName and self.common_name is None:
+                self.common_name = str(value)
+
+        self.subject_alt_names = []
+        for attribute in request_info.getComponentByName('attributes'):
+            if attribute.getComponentByName('type') != self.id_PKCS9_extensionRequest:  # we're only interested in the extension request part
+                continue
+
+            extensions, _ = pyasn1.codec.der.decoder.decode(attribute.getComponentByName('vals')[0],
+                                                            asn1Spec=pyasn1_modules.rfc2459.Extensions())
+            for extension in extensions:
+                oid = extension.getComponentByName('extnID')
+                if oid != pyasn1_modules.rfc2459.id_ce_subjectAltName:  # we're only interested in the subject alternative name
+                    continue
+
+                subject_alt_names_raw = extension.getComponentByName('extnValue').asOctets()
+                if subject_alt_names_raw[:1] == b'\x04':  # older pyasn1-modules keep the OctetString wrapper
+                    subject_alt_names_raw = pyasn1.codec.der.decoder.decode(subject_alt_names_raw,
+                                                                            asn1Spec=pyasn1.type.univ.OctetString())[0]
+                subject_alt_names = pyasn1.codec.der.decoder.decode(subject_alt_names_raw,
+                                                                    asn1Spec=pyasn1_modules.rfc2459.SubjectAltName())[0]
+                for general_name in subject_alt_names:
+                    self.subject_alt_names.append((general_name.getName(), str(general_name.getComponent())))
+
+        public_key_info = pyasn1.codec.der.encoder.encode(request_info.getComponentByName('subjectPublicKeyInfo'))
+        self.public_key_fingerprint = hashlib.sha256(public_key_info).hexdigest()
+
+    @classmethod
+    def load_many(cls, path_or_glob, processes=None, errors=None):
+        """
+        Parses all CSRs in a directory (*.csr) or matching a glob pattern in parallel.
+
+        :param path_or_glob: directory or glob pattern
+        :param processes: number of parser processes (default: number of CPUs, 1 parses in the current process)
+        :param errors: optional list, invalid files are skipped and appended to it as (filename, error) tuples
+        :return: list of CSR instances (sorted by filename)
+        :raises ValueError: if a file isn't a valid CSR (and no errors list is given)
+        """
+        import glob
+
+        if os.path.isdir(path_or_glob):
+            path_or_glob = os.path.join(path_or_glob, "*.csr")
+        filenames = sorted(glob.glob(path_or_glob))
+
+        pems = []
+        for filename in filenames:
+            with open(filename, 'r') as f:
+                pems.append(f.read())
+
+        if processes == 1 or len(pems) <= 1:
+            parsed = [_parse_csr(pem) for pem in pems]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                parsed = list(executor.map(_parse_csr, pems, chunksize=16))
+
+        csrs = []
+        for filename, (csr, error) in zip(filenames, parsed):
+            if error:
+                if errors is None:
+                    raise ValueError("%s: %s" % (filename, error))
+                errors.append((filename, error))
+                continue
+            csr.filename = filename
+            csrs.append(csr)
+        return csrs
 
     def get_pem(self):
         """
@@ -93,42 +290,725 @@ class CSR:
         """
         Returns the common-name
         """
-        subject_rdn_sequence = self.asn1.getComponentByName('certificationRequestInfo').getComponentByName('subject')[0]
-        for subject in subject_rdn_sequence:
-            name = subject[0]
-            oid = name.getComponentByName('type')
-            value = name.getComponentByName('value')
-            if oid == pyasn1_modules.rfc2459.id_at_commonName:
-                value = pyasn1.codec.der.decoder.decode(value, asn1Spec=pyasn1_modules.rfc2459.DirectoryString())[0]
-                return str(value.getComponent())
+        return self.common_name
 
     def get_subject_alt_names(self, types=None):
         """
         Yields (type, value) tupels for each SubjectAltName.
         Types can be specified to filter limit the result to specific types.
         """
-        for attribute_type, attribute_value in self.asn1.getComponentByName(
-                'certificationRequestInfo').getComponentByName('attributes'):
-            if attribute_type != self.id_PKCS9_extensionRequest:  # we're only interested in the extension request part
+        for subject_alt_name_type, subject_alt_name_value in self.subject_alt_names:
+            if types and subject_alt_name_type not in types:  # skip unwanted types
                 continue
+            yield subject_alt_name_type, subject_alt_name_value
 
-            extensions, _ = pyasn1.codec.der.decoder.decode(attribute_value[0],
-                                                            asn1Spec=pyasn1_modules.rfc2459.Extensions())
-            for extension in extensions:
-                oid = extension.getComponentByName('extnID')
-                if oid != pyasn1_modules.rfc2459.id_ce_subjectAltName:  # we're only interested in the subject alternative name
-                    continue
+    def get_subjects(self):
+        """
+        Returns the common name followed by all (other) dNSName SubjectAltNames
+        """
+        subjects = [self.get_common_name()]
+        for t, v in self.get_subject_alt_names(types=['dNSName']):
+            if v not in subjects:
+                subjects.append(v)
+        return subjects
 
-                subject_alt_names_raw = pyasn1.codec.der.decoder.decode(extension.getComponentByName('extnValue'),
-                                                                        asn1Spec=pyasn1.type.univ.OctetString())[0]
-                subject_alt_names = pyasn1.codec.der.decoder.decode(subject_alt_names_raw,
-                                                                    asn1Spec=pyasn1_modules.rfc2459.SubjectAltName())[0]
-                for general_name in subject_alt_names:
-                    subject_alt_name_type = general_name.getName()
-                    subject_alt_name_value = general_name.getComponent()
-                    if types and subject_alt_name_type not in types:  # skip unwanted types
-                        continue
-                    yield subject_alt_name_type, str(subject_alt_name_value)
+
+def _parse_csr(pem):
+    """
+    Parses a PEM encoded CSR and returns (CSR, error) (worker for CSR.load_many())
+    """
+    try:
+        return CSR(pem), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def _parse_csr_subjects(pem):
+    """
+    Parses a PEM encoded CSR and returns (subjects, error, parse time) (worker for CSR batch processing)
+    """
+    start = time.time()
+    try:
+        csr = CSR(pem)
+        if not csr.get_common_name():
+            return None, "invalid CSR: no common name", time.time() - start
+        return csr.get_subjects(), None, time.time() - start
+    except Exception as e:
+        return None, "invalid CSR: %s" % e, time.time() - start
+
+
+class Certificate(Mapping):
+    """
+    Entry of the certificate list, see API.get_certificates_list().
+
+    A compact record (__slots__) with a read-only mapping interface (cert['name'], dict(cert), ...) whose keys
+    are FIELDS. For compatibility the date parts are also available as '<date>_year', '<date>_month' and '<date>_day'
+    (zero padded strings), they aren't stored or listed as keys.
+    """
+    FIELDS = ('id', 'order_number', 'name', 'class', 'profile', 'product', 'status', 'issuance_date', 'expiry_date')
+    DATE_PARTS = {'_year': "%Y", '_month': "%m", '_day': "%d"}
+    __slots__ = FIELDS
+
+    def __init__(self, *values, **fields):
+        """
+        :param values: values of FIELDS in order (the fast way, used by the parser)
+        :param fields: values of FIELDS by name (missing ones are None, unknown ones are ignored)
+        """
+        if values:
+            for field, value in zip(self.FIELDS, values):
+                setattr(self, field, value)
+        else:
+            for field in self.FIELDS:
+                setattr(self, field, fields.get(field))
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        date_key, sep, part = key.rpartition("_")
+        if date_key in ('issuance_date', 'expiry_date') and "_" + part in self.DATE_PARTS:
+            date = getattr(self, date_key)
+            return date.strftime(self.DATE_PARTS["_" + part]) if date is not None else None
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return "Certificate(%r)" % dict(self)
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def format(self, format_string):
+        """
+        str.format() with the fields (and date parts) as named arguments, e.g. "{name} ({expiry_date})"
+        """
+        return string.Formatter().vformat(format_string, (), self)
+
+    def to_json(self, fields=FIELDS):
+        """
+        Returns a dict of the fields which can be serialized as JSON (dates as ISO 8601 strings)
+        """
+        record = {}
+        for field in fields:
+            value = self[field]
+            record[field] = value.isoformat() if isinstance(value, datetime.date) else value
+        return record
+
+
+def filter_certificates(certificates, status=None, profile=None, expires_after=None, expires_before=None):
+    """
+    Filters certificate entries (lazily, works with the paged API.get_certificates_list())
+
+    :param status: only entries with one of these status (iterable)
+    :param profile: only entries with one of these profiles (iterable)
+    :param expires_after: only entries which expire on or after this date
+    :param expires_before: only entries which expire on or before this date
+    :return: generator of the matching entries
+    """
+    status = frozenset(status) if status else None
+    profile = frozenset(profile) if profile else None
+    for cert in certificates:
+        if status is not None and cert['status'] not in status:
+            continue
+        if profile is not None and cert['profile'] not in profile:
+            continue
+        if expires_after is not None or expires_before is not None:
+            expiry_date = cert['expiry_date']
+            if expiry_date is None:
+                continue
+            if expires_after is not None and expiry_date < expires_after:
+                continue
+            if expires_before is not None and expiry_date > expires_before:
+                continue
+        yield cert
+
+
+def write_certificates(certificates, out, output_format="jsonl", fields=Certificate.FIELDS):
+    """
+    Writes certificate entries to a file as they arrive (one JSON object per line or CSV with header)
+
+    :param certificates: iterable of certificate entries
+    :param out: text file
+    :param output_format: jsonl or csv
+    :param fields: fields to write (FIELDS of Certificate or date parts)
+    :return: number of written entries
+    """
+    count = 0
+    if output_format == "csv":
+        import csv
+
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(fields)
+        for cert in certificates:
+            record = cert.to_json(fields)
+            writer.writerow(["" if record[field] is None else record[field] for field in fields])
+            count += 1
+    elif output_format == "jsonl":
+        for cert in certificates:
+            out.write(json.dumps(cert.to_json(fields), sort_keys=True) + "\n")
+            count += 1
+    else:
+        raise ValueError("unknown output format %s" % output_format)
+    return count
+
+
+class CertificateListParser(object):
+    """
+    Incremental parser for CertList pages.
+
+    The page can be fed in chunks (feed()). The input is split at row boundaries with plain string searches,
+    each certificate row is converted to a certificate entry (see API.get_certificates_list()) as soon as its </tr>
+    has been seen. The per row patterns only use negated character classes (no nested lazy wildcards),
+    so there is no catastrophic backtracking. pop_certificates() returns the completed entries.
+    """
+    ROW_START = '<tr style="text-align:center;">'
+    ROW_END = '</tr>'
+    COLUMNS = 6
+    CELL = _LazyRegex(r'<td([^>]*)>([^<]*(?:<(?!/td>)[^<]*)*)</td>')
+    MARKUP = _LazyRegex(r'<!--(?:[^-]|-(?!->))*-->|<[^>]*>')
+    TITLE = _LazyRegex(r'title="([^"]*)"')
+    DATE = _LazyRegex(r'(\d{4})-(\d{2})-(\d{2})')
+    ORDER_ID = _LazyRegex(r'orderId=(?P<orderId>\w+)')
+
+    def __init__(self):
+        self.buffer = ""
+        self.certificates = []
+
+    def feed(self, data):
+        """
+        Parses the next chunk of the page
+        """
+        buf = self.buffer + data
+        pos = 0
+        while True:
+            start = buf.find(self.ROW_START, pos)
+            if start < 0:
+                # keep a possibly incomplete row start marker
+                pos = max(pos, len(buf) - len(self.ROW_START) + 1)
+                break
+            end = buf.find(self.ROW_END, start)
+            if end < 0:
+                pos = start  # incomplete row, wait for more data
+                break
+            cert = self._make_certificate(buf[start + len(self.ROW_START):end])
+            if cert is not None:
+                self.certificates.append(cert)
+            pos = end + len(self.ROW_END)
+        self.buffer = buf[pos:]
+
+    def close(self):
+        """
+        Ends the page, an incomplete row is discarded
+        """
+        self.buffer = ""
+
+    def pop_certificates(self):
+        """
+        Returns the certificate entries completed since the last call
+        """
+        certificates, self.certificates = self.certificates, []
+        return certificates
+
+    def _make_certificate(self, row):
+        """
+        Converts a certificate row (between <tr> and </tr>) to a certificate entry (or None if it's not a certificate row)
+        """
+        cells = self.CELL.findall(row)
+        if len(cells) != self.COLUMNS:
+            return None
+        texts = [self.MARKUP.sub("", html).strip() for attrs, html in cells[:5]]
+        if not texts[0].isdigit():
+            return None
+
+        title = self.TITLE.search(cells[1][0])
+        product = texts[2]
+
+        # convert Issuance Date
+        dates = self.DATE.findall(texts[3])
+        if len(dates) == 2:
+            issuance_date = datetime.date(*[int(x) for x in dates[0]])
+            expiry_date = datetime.date(*[int(x) for x in dates[1]])
+        else:
+            issuance_date = expiry_date = None
+
+        # convert profile description to profile identifier
+        if product.endswith("SSL"):
+            profile = "server"
+        elif product.endswith("Client"):
+            profile = "client"
+        elif product.endswith("Code Signing"):
+            profile = "object"
+        else:
+            profile = None
+
+        item = self.ORDER_ID.search(cells[5][1])
+
+        cert = Certificate(item.group('orderId') if item is not None else None,  # id
+                           int(texts[0]),  # order_number
+                           title.group(1) if title else texts[1],  # name
+                           int(product[6]) if product.startswith("Class") else None,  # class
+                           profile, product, texts[4], issuance_date, expiry_date)
+
+        """
+        # set retrieved state depending on the background color
+        if cert['color'] == "FFFFFF":
+            cert['retrieved'] = True
+        else:  # if color = rgb(201, 255, 196)
+            cert['retrieved'] = False
+        del cert['color']
+        """
+        return cert
+
+
+class DomainIndex(object):
+    """
+    Lookup index for validated domains.
+
+    The domains are stored in a hash set, a lookup checks the name and each of its parent domains
+    (most specific first), so it takes O(labels) and only matches on label boundaries
+    (evilexample.com isn't covered by example.com).
+    """
+
+    def __init__(self, domains=()):
+        """
+        :param domains: validated domains
+        """
+        self.domains = {}  # normalized domain -> domain as validated
+        for domain in domains:
+            self.domains[self.normalize(domain)] = domain
+
+    @staticmethod
+    def normalize(name):
+        """
+        Domain names are case insensitive and may be written fully qualified (trailing dot)
+        """
+        return name.lower().rstrip(".")
+
+    def lookup(self, name):
+        """
+        Returns the most specific validated (parent) domain of name or None.
+        """
+        name = self.normalize(name)
+        while True:
+            validated_domain = self.domains.get(name)
+            if validated_domain is not None:
+                return validated_domain
+            dot = name.find(".")
+            if dot < 0:
+                return None
+            name = name[dot+1:]
+
+    def lookup_many(self, names):
+        """
+        Bulk lookup, e.g. for all SubjectAltNames of a CSR.
+
+        :return: dict name -> the most specific validated (parent) domain or None
+        """
+        return dict((name, self.lookup(name)) for name in names)
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def __len__(self):
+        return len(self.domains)
+
+
+class Metrics(object):
+    """
+    Request metrics registry, register it with API.add_request_hook().
+
+    Records per endpoint request counts by status, latency histograms, transferred bytes and errors.
+    The metrics can be exported as JSON (to_json()), in the Prometheus text format (to_prometheus())
+    or as human readable summary (summary()).
+    """
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __call__(self, event):
+        with self.lock:
+            endpoint = self.endpoints.get(event['endpoint'])
+            if endpoint is None:
+                endpoint = self.endpoints[event['endpoint']] = {
+                    'requests': 0, 'statuses': {}, 'errors': {}, 'seconds': 0.0, 'max_seconds': 0.0,
+                    'buckets': [0] * len(self.BUCKETS), 'bytes_sent': 0, 'bytes_received': 0, 'bytes_decoded': 0,
+                    'connections_opened': 0, 'connections_reused': 0, 'compressed': 0, 'retries': 0,
+                }
+            endpoint['requests'] += 1
+            if event.get('attempt', 1) > 1:
+                endpoint['retries'] += 1
+            if event['error'] is not None:
+                error = type(event['error']).__name__
+                endpoint['errors'][error] = endpoint['errors'].get(error, 0) + 1
+            else:
+                status = str(event['status'])
+                endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+            endpoint['seconds'] += event['seconds']
+            endpoint['max_seconds'] = max(endpoint['max_seconds'], event['seconds'])
+            for i, bound in enumerate(self.BUCKETS):
+                if event['seconds'] <= bound:
+                    endpoint['buckets'][i] += 1
+                    break
+            endpoint['bytes_sent'] += event['bytes_sent']
+            endpoint['bytes_received'] += event['bytes_received']
+            endpoint['bytes_decoded'] += event.get('bytes_decoded', event['bytes_received'])
+            if event['connection_reused']:
+                endpoint['connections_reused'] += 1
+            elif event['connection_reused'] is not None:
+                endpoint['connections_opened'] += 1
+            if event['compressed']:
+                endpoint['compressed'] += 1
+
+    def snapshot(self):
+        """
+        Returns a copy of the metrics: dict endpoint -> dict with 'requests', 'statuses' (status -> count),
+        'errors' (exception name -> count), 'seconds' (total), 'max_seconds', 'buckets' (non-cumulative counts per
+        Metrics.BUCKETS upper bound), 'bytes_sent', 'bytes_received' (as transferred), 'bytes_decoded' (after
+        decompression), 'connections_opened', 'connections_reused',
+        'compressed' (number of compressed responses), 'retries' (number of retried requests)
+        """
+        with self.lock:
+            return json.loads(json.dumps(self.endpoints))
+
+    def to_json(self):
+        return json.dumps({'buckets': [str(bound) for bound in self.BUCKETS], 'endpoints': self.snapshot()},
+                          indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        endpoints = self.snapshot()
+        lines = []
+
+        def metric(name, metric_type, help_text):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+
+        metric("startssl_requests_total", "counter", "HTTP requests by endpoint and status.")
+        for endpoint, m in sorted(endpoints.items()):
+            for status, count in sorted(m['statuses'].items()):
+                lines.append('startssl_requests_total{endpoint="%s",status="%s"} %d' % (endpoint, status, count))
+        metric("startssl_request_errors_total", "counter", "HTTP requests which failed without a response.")
+        for endpoint, m in sorted(endpoints.items()):
+            for error, count in sorted(m['errors'].items()):
+                lines.append('startssl_request_errors_total{endpoint="%s",error="%s"} %d' % (endpoint, error, count))
+        metric("startssl_request_duration_seconds", "histogram", "HTTP request latency.")
+        for endpoint, m in sorted(endpoints.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, m['buckets']):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append('startssl_request_duration_seconds_bucket{endpoint="%s",le="%s"} %d' % (endpoint, le, cumulative))
+            lines.append('startssl_request_duration_seconds_sum{endpoint="%s"} %f' % (endpoint, m['seconds']))
+            lines.append('startssl_request_duration_seconds_count{endpoint="%s"} %d' % (endpoint, m['requests']))
+        metric("startssl_request_bytes_total", "counter", "Request body bytes sent.")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_request_bytes_total{endpoint="%s"} %d' % (endpoint, m['bytes_sent']))
+        metric("startssl_response_bytes_total", "counter", "Response body bytes received (as transferred, before decompression).")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_response_bytes_total{endpoint="%s"} %d' % (endpoint, m['bytes_received']))
+        metric("startssl_response_decoded_bytes_total", "counter", "Response body bytes after decompression.")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_response_decoded_bytes_total{endpoint="%s"} %d' % (endpoint, m['bytes_decoded']))
+        metric("startssl_connections_total", "counter", "Requests by connection state (new or reused keep-alive connection).")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_connections_total{endpoint="%s",state="opened"} %d' % (endpoint, m['connections_opened']))
+            lines.append('startssl_connections_total{endpoint="%s",state="reused"} %d' % (endpoint, m['connections_reused']))
+        metric("startssl_compressed_responses_total", "counter", "Responses transferred compressed.")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_compressed_responses_total{endpoint="%s"} %d' % (endpoint, m['compressed']))
+        metric("startssl_request_retries_total", "counter", "Retries of transiently failed requests.")
+        for endpoint, m in sorted(endpoints.items()):
+            lines.append('startssl_request_retries_total{endpoint="%s"} %d' % (endpoint, m['retries']))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        lines = ["%-60s %8s %10s %10s %12s %12s %8s %8s %8s %s" % ("endpoint", "requests", "avg ms", "max ms", "received",
+                                                                    "decoded", "opened", "reused", "retries", "statuses")]
+        for endpoint, m in sorted(self.snapshot().items()):
+            statuses = dict(m['statuses'], **m['errors'])
+            lines.append("%-60s %8d %10.1f %10.1f %12d %12d %8d %8d %8d %s" % (
+                endpoint, m['requests'], m['seconds'] / m['requests'] * 1000, m['max_seconds'] * 1000,
+                m['bytes_received'], m['bytes_decoded'], m['connections_opened'], m['connections_reused'], m['retries'],
+                ", ".join("%s: %d" % item for item in sorted(statuses.items()))))
+        return "\n".join(lines)
+
+
+# synthetic response header with the body size as transferred (httplib2 replaces content-length when it decompresses)
+RECEIVED_LENGTH = "-received-length"
+_connection_types = None
+
+
+def _counting_connection_types():
+    """
+    Returns the httplib2 connection classes (by scheme) which record the received body size in RECEIVED_LENGTH
+    """
+    global _connection_types
+    if _connection_types is None:
+        import httplib2
+        try:
+            from http.client import HTTPResponse  # python 3
+        except ImportError:
+            from httplib import HTTPResponse  # python 2
+
+        class CountingResponse(HTTPResponse):
+            received = 0
+
+            def read(self, amt=None):
+                data = HTTPResponse.read(self, amt)
+                self.received += len(data)
+                del self.msg[RECEIVED_LENGTH]
+                self.msg[RECEIVED_LENGTH] = str(self.received)
+                return data
+
+        class HTTPConnection(httplib2.HTTPConnectionWithTimeout):
+            response_class = CountingResponse
+
+        class HTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+            response_class = CountingResponse
+
+        _connection_types = {'http': HTTPConnection, 'https': HTTPSConnection}
+    return _connection_types
+
+
+class HttpPool(object):
+    """
+    Pool of keep-alive httplib2.Http instances shared by all threads of an API instance.
+
+    httplib2.Http isn't thread safe, so each instance only serves one request at a time. Idle instances
+    (and their open connections) are reused by the next request of any thread, at most `size` instances are created,
+    further requests wait for an idle one.
+    """
+
+    def __init__(self, ca_certs=None, size=8):
+        """
+        :param ca_certs: PEM encoded CA certificate file to authenticate the server
+        :param size: maximum number of instances (concurrent requests, open connections per host)
+        """
+        assert size > 0, "size must be positive"
+        self.ca_certs = ca_certs
+        self.size = size
+        self.certificates = []
+        self.instances = []
+        self.idle = []
+        self.condition = threading.Condition()
+
+    def add_certificate(self, key, cert):
+        """
+        Use a client certificate for all connections
+        """
+        with self.condition:
+            self.certificates.append((key, cert))
+            for h in self.instances:
+                h.add_certificate(key, cert, '')
+
+    def request(self, uri, **kwargs):
+        """
+        Sends a request with an idle instance, see httplib2.Http.request().
+        The response has an additional connection_reused attribute.
+        """
+        import httplib2
+
+        h = self.__acquire()
+        try:
+            scheme, authority, request_uri, defrag_uri = httplib2.urlnorm(uri)
+            connection = h.connections.get(scheme + ":" + authority)
+            connection_reused = connection is not None and connection.sock is not None
+            resp, content = h.request(uri, connection_type=_counting_connection_types()[scheme], **kwargs)
+            resp.connection_reused = connection_reused
+            return resp, content
+        finally:
+            self.__release(h)
+
+    def __acquire(self):
+        with self.condition:
+            while not self.idle and len(self.instances) >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()  # most recently used, most likely to still have an open connection
+
+            import httplib2
+            h = httplib2.Http(ca_certs=self.ca_certs)
+            h.follow_redirects = False
+            for key, cert in self.certificates:
+                h.add_certificate(key, cert, '')
+            self.instances.append(h)
+            return h
+
+    def __release(self, h):
+        with self.condition:
+            self.idle.append(h)
+            self.condition.notify()
+
+    def close(self):
+        """
+        Closes the open connections of all idle instances
+        """
+        with self.condition:
+            for h in self.idle:
+                for connection in h.connections.values():
+                    connection.close()
+                h.connections.clear()
+
+
+class RequestScheduler(object):
+    """
+    Paces the requests of an API instance and decides which failed requests are retried.
+
+    Transient failures (timeouts, dropped connections, truncated responses, 429 and 5xx gateway/unavailable responses)
+    are retried with a jittered exponential backoff, a Retry-After header of the server takes precedence. Concurrency and request rate adapt
+    AIMD style: each transient failure halves the concurrency limit and doubles the minimum interval between
+    requests, each success increases the limit by 1/limit (about one per round trip) and shrinks the interval
+    until the rate is unlimited again.
+
+    Non-idempotent requests (POST) are only retried if the server refused them (429, 503), a failed connection
+    could have been processed anyway.
+    """
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+    REFUSED_STATUSES = frozenset([429, 503])
+    IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+    TRANSIENT_ERRNOS = frozenset([errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE, errno.ETIMEDOUT])
+    MIN_INTERVAL = 0.01  # seconds, smallest interval between requests when throttled
+
+    def __init__(self, concurrency=8, retries=4, backoff=0.5, max_backoff=60.0):
+        """
+        :param concurrency: maximum number of concurrent requests
+        :param retries: maximum number of retries per request (0 disables retries)
+        :param backoff: base of the exponential backoff in seconds
+        :param max_backoff: upper bound of the backoff, longer Retry-After delays aren't waited for
+        """
+        assert concurrency > 0, "concurrency must be positive"
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limit = float(concurrency)  # current concurrency limit
+        self.interval = 0.0  # current minimum interval between requests
+        self.active = 0
+        self.next_start = 0.0
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        """
+        Takes a request slot if the concurrency limit and rate allow it.
+
+        :return: 0 if a slot was taken, otherwise the seconds to wait before trying again
+        """
+        with self.condition:
+            now = time.time()
+            if self.active >= int(self.limit):
+                return self.MIN_INTERVAL
+            if now < self.next_start:
+                return self.next_start - now
+            self.active += 1
+            self.next_start = now + self.interval
+            return 0
+
+    def acquire(self):
+        """
+        Waits for a request slot
+        """
+        with self.condition:
+            while True:
+                wait = self.try_acquire()
+                if not wait:
+                    return
+                self.condition.wait(wait)
+
+    def release(self, success):
+        """
+        Returns a request slot and adapts concurrency and rate.
+
+        :param success: False if the request failed transiently
+        """
+        with self.condition:
+            self.active -= 1
+            if success:
+                self.limit = min(self.concurrency, self.limit + 1.0 / self.limit)
+                self.interval = self.interval * 0.9 if self.interval > self.MIN_INTERVAL else 0.0
+            else:
+                self.limit = max(1.0, self.limit / 2)
+                self.interval = min(self.max_backoff, max(self.MIN_INTERVAL, self.interval * 2))
+            self.condition.notify_all()
+
+    def is_transient(self, resp=None, error=None):
+        """
+        Returns whether a request failed transiently (with the response resp or the exception error)
+        """
+        if error is not None:
+            return self.is_transient_error(error)
+        return resp.status in self.RETRY_STATUSES
+
+    def is_transient_error(self, error):
+        """
+        Returns whether an exception is a transient failure: a timeout, a connection dropped by the server
+        or a truncated/missing response. Errors which don't go away by retrying (refused connections, unknown hosts,
+        certificate verification, ...) are raised right away.
+        """
+        import ssl
+
+        if isinstance(error, ssl.SSLError):
+            return isinstance(error, getattr(ssl, 'SSLEOFError', ()))  # connection closed during the handshake
+        if isinstance(error, self.retry_errors()):
+            return True
+        return isinstance(error, socket.error) and error.errno in self.TRANSIENT_ERRNOS
+
+    def retry_errors(self):
+        """
+        Returns the exception types of transient failures besides the socket errors in TRANSIENT_ERRNOS
+        """
+        try:
+            from http.client import BadStatusLine, IncompleteRead  # python 3
+        except ImportError:
+            from httplib import BadStatusLine, IncompleteRead  # python 2
+
+        return socket.timeout, BadStatusLine, IncompleteRead
+
+    def retry_delay(self, attempt, method, resp=None, error=None):
+        """
+        Returns the seconds to wait before retrying a request or None if it shouldn't be retried.
+
+        :param attempt: number of attempts so far (1 after the first request)
+        :param method: HTTP method of the request
+        :param resp: the response or None if the request raised error
+        :param error: the exception or None
+        """
+        if attempt > self.retries or not self.is_transient(resp, error):
+            return None
+        if method not in self.IDEMPOTENT_METHODS and (resp is None or resp.status not in self.REFUSED_STATUSES):
+            return None
+
+        retry_after = self.parse_retry_after(resp.get('retry-after')) if resp is not None else None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_backoff else None
+        import random
+
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Parses a Retry-After header (seconds or HTTP date), returns seconds or None
+        """
+        import email.utils
+
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
 
 
 class API(object):
@@ -143,38 +1023,121 @@ class API(object):
     STARTSSL_GETEMAILSURI = "https://startssl.com/ControlPanel/AjaxRequestGetAllEmailValis"
     STARTSSL_SUBMITCSR = "https://startssl.com/Certificates/ssl"
 
-    RETRIEVE_CERTIFICATE_LIST = re.compile(
-        '<tr style="text-align:center;">\s+<td style="vertical-align:middle;">(?P<order_number>\d+)</td>\s+<td align="left" style="vertical-align:middle;" title="(?P<name>.+?)">.+?</td>\s+<td align="left" style="vertical-align:middle;">(?P<product>[\w ]+?)</td>\s+<td style="vertical-align:middle;">\s*(?:<span>)?(?P<issuance_date_year>\d{4})?-?(?P<issuance_date_month>\d{2})?-?(?P<issuance_date_day>\d{2})?(?:</span><br /><span>)?(?P<expiry_date_year>\d{4})?-?(?P<expiry_date_month>\d{2})?-?(?P<expiry_date_day>\d{2})?(?:</span>)?\s*</td>\s+<td style="vertical-align:middle;">\s+(?P<status>.+?)<!--.*?-->\s+</td>\s+<td align="center" style="vertical-align:middle;">\s*(?s)(?P<actions_code>.*?)\s*</td>\s*</tr>',
-        re.UNICODE)
-    RETRIEVE_CERTIFICATE_LIST_ACCTION_ID = re.compile('orderId=(?P<orderId>\w+)')
-    REQUEST_CERTIFICATE_CSR_ID = re.compile(
-        'x_third_step_certs\(\\\\\'(?P<type>\w+?)\\\\\',\\\\\'(?P<csr_id>\d+?)\\\\\',\\\\\'(?P<unknown>.*?)\\\\\',showCertsWizard\);')
-    REQUEST_CERTIFICATE_READY_CN = re.compile(
+    REQUEST_CERTIFICATE_CSR_ID = _LazyRegex(
+        r"x_third_step_certs\(\\'(?P<type>\w+?)\\',\\'(?P<csr_id>\d+?)\\',\\'(?P<unknown>.*?)\\',showCertsWizard\);")
+    REQUEST_CERTIFICATE_READY_CN = _LazyRegex(
         '<li>The common name of this certificate will be set to <b><i>(?P<cn>.+?)</i></b>.</li>')
-    REQUEST_CERTIFICATE_READY_DOMAINS = re.compile('<li><b><i>(?P<domain>.+?)</i></b></li>')
-    REQUEST_CERTIFICATE_CERT = re.compile('<textarea.*?>(?P<certificate>.*?)</textarea>')
-    VALIDATED_RESSOURCES = re.compile('<td nowrap>(?P<resource>.+?)</td><td nowrap> <img src="/img/yes-sm.png"></td>')
+    REQUEST_CERTIFICATE_READY_DOMAINS = _LazyRegex('<li><b><i>(?P<domain>.+?)</i></b></li>')
+    REQUEST_CERTIFICATE_CERT = _LazyRegex('<textarea.*?>(?P<certificate>.*?)</textarea>')
+    VALIDATED_RESSOURCES = _LazyRegex('<td nowrap>(?P<resource>.+?)</td><td nowrap> <img src="/img/yes-sm.png"></td>')
+    VALIDATED_RESOURCES_BODY = [('app', 12)]
     CERTIFICATE_PROFILES = {'smime': "S/MIME", 'server': "Server", 'xmpp': "XMPP", 'code': "Object"}
 
-    def __init__(self, ca_certs=STARTCOM_CA, user_agent=None):
+    def __init__(self, ca_certs=STARTCOM_CA, user_agent=None, connections=8, retries=4):
         """
         Init the StartSSL API.
 
         :param ca_certs: PEM encoded CA certificate file to authenticate the server
+        :param connections: maximum number of concurrent requests (keep-alive connections are reused between them)
+        :param retries: maximum number of retries of transiently failed requests (0 disables retries)
         """
-        self.h = httplib2.Http(ca_certs=ca_certs)
-        self.h.follow_redirects = False
+        self.ca_certs = ca_certs
+        self.client_certificate = None
+        self.http = HttpPool(ca_certs=ca_certs, size=connections)
+        self.scheduler = RequestScheduler(concurrency=connections, retries=retries)
         self.user_agent = user_agent
         self.validated_emails = None
         self.validated_domains = None
+        self.validated_domains_index = None
+        self.validated_cache = None
+        self.validated_cached = False
         self.authenticated = False
         self.cookies = None
+        self.session_file = None
+        self.session_ttl = None
+        self.session_cached = False
+        self.__session_lock = threading.Lock()
+        self.request_hooks = []
 
     # noinspection PyShadowingNames
-    def __request(self, *args, **kwargs):
+    def __request(self, uri, **kwargs):
         """
         Wrapper for HTTP requests
         """
+        self._prepare_request(kwargs)
+
+        resp, content = self.__send(uri, **kwargs)
+        if self.authenticated and uri != self.STARTSSL_AUTHURI and self._session_rejected(resp):
+            # the session is no longer valid (an expired cached session or the session of a long running process),
+            # fall back to client certificate authentication and retry
+            self.__reauthenticate(kwargs['headers'].get('Cookie'))
+            kwargs['headers']['Cookie'] = self.cookies
+            resp, content = self.__send(uri, **kwargs)
+
+        return resp, self._decode_content(resp, content)
+
+    def __send(self, uri, **kwargs):
+        """
+        Sends a request paced by the scheduler, transient failures are retried (see RequestScheduler).
+        The request hooks are only involved (and the request only timed) if there are any.
+        """
+        method = kwargs.get('method', "GET")
+        attempt = 0
+        while True:
+            attempt += 1
+            self.scheduler.acquire()
+            resp = content = error = None
+            start = time.time()
+            try:
+                resp, content = self.http.request(uri, **kwargs)
+            except Exception as e:
+                error = e
+            transient = self.scheduler.is_transient(resp, error)
+            self.scheduler.release(not transient)
+            if self.request_hooks:
+                self._call_request_hooks(uri, kwargs, resp, content, time.time() - start, error, attempt)
+
+            delay = self.scheduler.retry_delay(attempt, method, resp, error) if transient else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return resp, content
+            time.sleep(delay)
+
+    def add_request_hook(self, hook):
+        """
+        Registers a callable which is called after each HTTP request with a dict with the keys:
+        'method', 'endpoint' (host and path), 'status' (None on errors), 'seconds', 'bytes_sent',
+        'bytes_received' (response body as transferred, i.e. compressed), 'bytes_decoded' (after decompression),
+        'connection_reused' (whether an open keep-alive connection was used), 'compressed' (response content encoding
+        or None), 'error' (the exception or None), 'attempt' (1 for the first attempt, >1 for retries)
+
+        A Metrics instance can be used as hook.
+        """
+        self.request_hooks.append(hook)
+
+    def _call_request_hooks(self, uri, kwargs, resp, content, seconds, error=None, attempt=1):
+        url = urlsplit(uri)
+        event = {
+            'method': kwargs.get('method', "GET"),
+            'endpoint': url.netloc + url.path,
+            'status': resp.status if resp is not None else None,
+            'seconds': seconds,
+            'bytes_sent': len(kwargs.get('body') or ""),
+            'bytes_received': int(resp.get(RECEIVED_LENGTH, len(content))) if content is not None else 0,
+            'bytes_decoded': len(content) if content is not None else 0,
+            'connection_reused': getattr(resp, 'connection_reused', None),
+            'compressed': resp.get('-content-encoding') if resp is not None else None,
+            'error': error,
+            'attempt': attempt,
+        }
+        for hook in self.request_hooks:
+            hook(event)
+
+    def _prepare_request(self, kwargs):
+        """
+        Adds the common headers and encodes the body of a request (kwargs for httplib2.Http.request())
+        """
         # make sure headers exist
         if "headers" not in kwargs:
             kwargs['headers'] = {}
@@ -190,70 +1153,229 @@ class API(object):
         if "body" in kwargs and type(kwargs['body']) is list:
             kwargs['body'] = urlencode(kwargs['body'])
 
+        # ask for compressed responses (decompressed transparently)
+        if "Accept-Encoding" not in kwargs['headers']:
+            kwargs['headers']['Accept-Encoding'] = "gzip, deflate"
+
         # add Content-Type: urlencoded if method is POST and content type is unset
         if "method" in kwargs and kwargs['method'] == "POST" and "Content-Type" not in kwargs['headers']:
             kwargs['headers']['Content-Type'] = "application/x-www-form-urlencoded"
 
-        resp, content = self.h.request(*args, **kwargs)
+    @staticmethod
+    def _decode_content(resp, content):
+        """
+        Decodes HTML responses
+        """
         if resp.get("content-type", None) == 'text/html; charset=utf-8':
             content = content.decode('utf-8')
-
-        return resp, content
+        return content
 
     # noinspection PyShadowingNames
-    def authenticate(self, cert, key):
+    def authenticate(self, cert, key, session_file=None, session_ttl=3600):
         """
         Use the cert/key to authenticate the session.
 
+        If a session_file is given, the session cookie is cached there (readable by the owner only) and reused
+        by later API instances until it expires. A cached session isn't validated upfront, it's used until the server
+        rejects it, in which case the client certificate authentication is done transparently (this also applies to
+        sessions which expire while the API instance is in use).
+
         :param cert: path to pem encoded client certificate
         :param key: path to pem encoded client key
+        :param session_file: optional path to cache the session cookie across processes
+        :param session_ttl: seconds a cached session is reused
         :return: True on success
         """
-        self.h.add_certificate(key, cert, '')
+        self.client_certificate = (key, cert)
+        self.http.add_certificate(key, cert)
+        self.session_file = session_file
+        self.session_ttl = session_ttl
+
+        if session_file and self._load_session():
+            self.session_cached = True
+        else:
+            self.__authenticate()
+        self.authenticated = True
+
+        return self.authenticated
+
+    def __authenticate(self):
+        """
+        Authenticates the session using the client certificate
+        """
         resp, content = self.__request(self.STARTSSL_AUTHURI, method="GET")
+        self._check_authentication(resp)
+
+    def _check_authentication(self, resp):
+        """
+        Takes the session cookie from the response of the client certificate authentication
+        """
         assert resp.status == 302, resp
         assert resp["location"].startswith("https://Startssl.com/ControlPanel"), resp
         assert "set-cookie" in resp, resp
         assert resp["set-cookie"].startswith("MyStartSSLCookie="), resp["set-cookie"]
         self.cookies = resp["set-cookie"]
-        self.authenticated = True
 
-        return self.authenticated
+        if self.session_file:
+            self._save_session()
+
+    def __reauthenticate(self, rejected_cookies):
+        """
+        Replaces a rejected session (once, even if multiple threads noticed the rejection)
+        """
+        with self.__session_lock:
+            if self.cookies == rejected_cookies:
+                self.session_cached = False
+                self.__authenticate()
+
+    @staticmethod
+    def _session_rejected(resp):
+        """
+        Checks if a response indicates that the session cookie wasn't accepted
+        """
+        if resp.status in (401, 403):
+            return True
+        if resp.status == 302:
+            location = resp.get("location", "").lower()
+            return "auth.startssl.com" in location or "login" in location
+        return False
+
+    def _load_session(self):
+        """
+        Loads the session cookie from the session file
+
+        :return: True if a cached session for the current client certificate which didn't expire yet was found
+        """
+        if not os.path.exists(self.session_file):
+            return False
+        try:
+            with open(self.session_file, 'r') as f:
+                session = json.load(f)
+        except ValueError:  # corrupt session file
+            return False
+        if session.get('client_crt') != os.path.abspath(self.client_certificate[1]):
+            return False
+        if session.get('expires', 0) <= time.time():
+            return False
+        self.cookies = session['cookie']
+        return True
+
+    def _save_session(self):
+        """
+        Stores the session cookie in the session file (mode 0600)
+        """
+        session = {
+            'cookie': self.cookies,
+            'client_crt': os.path.abspath(self.client_certificate[1]),
+            'expires': time.time() + self.session_ttl,
+        }
+        _atomic_write(self.session_file, json.dumps(session), mode=0o600)
 
     def get_validated_resources(self, force_update=False):
         """
         Returns validated resources (emails/domains) which can be used in certificate requests.
         By default the data is only updated during the initial call. After that the cached data will be returned.
 
-        :param force_update: Setting this to True will refresh the cache
+        If validated_cache is set (see ValidatedResourcesCache), the resources are shared with other processes until
+        the cache expires. Concurrent processes with an expired cache wait for the first one to fetch the resources.
+
+        :param force_update: Setting this to True will refresh the cache (including the shared cache)
         :return: [validated_emails], [self.validated_domains]
         """
         assert self.authenticated, "not authenticated"
         if self.validated_emails is not None and self.validated_domains is not None and not force_update:
             return self.validated_emails, self.validated_domains
 
-        self.validated_emails = []
-        self.validated_domains = []
+        if self.validated_cache is None:
+            self.__fetch_validated_resources()
+        elif force_update or not self._load_validated_resources():
+            with self.validated_cache.lock():
+                # another process may have refreshed the cache while we were waiting for the lock
+                if force_update or not self._load_validated_resources():
+                    self.__fetch_validated_resources()
+                    self._save_validated_resources()
+
+        return self.validated_emails, self.validated_domains
+
+    def __fetch_validated_resources(self):
+        resp, content = self.__request(self._validated_resources_uri(self.STARTSSL_GETDOMAINSURI), method="GET", body=self.VALIDATED_RESOURCES_BODY)
+        self._set_validated_domains(resp, content)
+
+        resp, content = self.__request(self._validated_resources_uri(self.STARTSSL_GETEMAILSURI), method="GET", body=self.VALIDATED_RESOURCES_BODY)
+        self._set_validated_emails(resp, content)
+        self.validated_cached = False
+
+    def _load_validated_resources(self):
+        """
+        Takes the validated resources from the shared cache
+
+        :return: True if the cache holds unexpired resources of the current client certificate
+        """
+        cached = self.validated_cache.load(os.path.abspath(self.client_certificate[1]))
+        if cached is None:
+            return False
+        self.validated_emails, self.validated_domains, self.validated_domains_index = cached
+        self.validated_cached = True
+        return True
+
+    def _save_validated_resources(self):
+        self.validated_cache.save(os.path.abspath(self.client_certificate[1]), self.validated_emails,
+                                  self.validated_domains, self.validated_domains_index)
+
+    def invalidate_validated_resources(self):
+        """
+        Drops the validated resources (including the shared cache), e.g. after a new domain validation.
+        They are fetched again on next use.
+        """
+        self.validated_emails = None
+        self.validated_domains = None
+        self.validated_domains_index = None
+        self.validated_cached = False
+        if self.validated_cache is not None:
+            self.validated_cache.invalidate()
+
+    def _stale_validations(self, subjects_lists):
+        """
+        Checks if resources taken from the shared cache miss a validation for one of the subjects,
+        the validation may be newer than the cache.
+        """
+        return self.validated_cached and any(self.validated_domains_index.lookup(subject) is None
+                                             for subjects in subjects_lists for subject in subjects)
 
-        body = [('app', 12)]
-        resp, content = self.__request(self.STARTSSL_GETDOMAINSURI + '?cacheKey=' + str(uuid.uuid4()), method="GET", body=body)
+    @staticmethod
+    def _validated_resources_uri(uri):
+        """
+        Adds a unique cache key to a validated resources URI
+        """
+        import uuid
+
+        return uri + '?cacheKey=' + str(uuid.uuid4())
+
+    def _set_validated_domains(self, resp, content):
+        """
+        Takes the validated domains from the AjaxRequestGetAllDomainValis response
+        """
         assert resp.status == 200
 
         parsed_domains = json.loads(content.decode())
 
+        self.validated_domains = []
         for domain in parsed_domains:
             self.validated_domains.append(domain['Domain'])
+        self.validated_domains_index = DomainIndex(self.validated_domains)
 
-        resp, content = self.__request(self.STARTSSL_GETEMAILSURI + '?cacheKey=' + str(uuid.uuid4()), method="GET", body=body)
+    def _set_validated_emails(self, resp, content):
+        """
+        Takes the validated emails from the AjaxRequestGetAllEmailValis response
+        """
         assert resp.status == 200
 
         parsed_emails = json.loads(content.decode())
 
+        self.validated_emails = []
         for email in parsed_emails:
             self.validated_emails.append(email['Email'])
 
-        return self.validated_emails, self.validated_domains
-
     def is_validated_domain(self, domain):
         """Check the validation status of a (sub)domain
 
@@ -262,81 +1384,150 @@ class API(object):
         """
         self.get_validated_resources()
 
-        # noinspection PyTypeChecker
-        for validated_domain in self.validated_domains:
-            if domain.endswith(validated_domain):
-                return validated_domain
-        return False
+        return self.validated_domains_index.lookup(domain) or False
 
-    def get_certificates_list(self):
+    def get_certificates_list(self, prefetch=0):
         """
         Returns the available signed certificates.
 
-        Each certificate entry (dict) has the following keys:
+        Each certificate entry (Certificate, a read-only mapping) has the following keys:
         'id', 'order_number', 'name', 'class', 'profile', 'product', 'status',
-        'issuance_date' (datetime), 'issuance_date_day', 'issuance_date_year', 'issuance_date_month'
-        'expiry_date' (datetime), 'expiry_date_day', 'expiry_date_year', 'expiry_date_month'
+        'issuance_date' (datetime.date), 'expiry_date' (datetime.date)
+        The date parts are also available as e.g. cert['expiry_date_year'].
 
-        :return: a list of certificate dicts
+        The list is paged. By default the next page is only requested once all entries of the current page
+        have been consumed. With prefetch > 0 a background thread fetches up to `prefetch` pages ahead,
+        so network latency overlaps with parsing and the caller's processing.
+
+        :param prefetch: number of pages to fetch ahead in the background (0 disables prefetching)
+        :return: generator of Certificate entries
         """
-        hasNextPage = True
-        pageindex = 0
-        while hasNextPage:
-            resp, content = self.__request(self.STARTSSL_BASEURI+"/CertList?pageindex="+str(pageindex), method="GET")
-            assert resp.status == 200, resp
-            assert "Certificate List<!--Cert List-->" in content, content
-
-            items = self.RETRIEVE_CERTIFICATE_LIST.finditer(content)
-            for item in items:
-                cert = item.groupdict()
-
-                # convert Issuance Date
-                if cert['issuance_date_year'] != None:
-                    cert['issuance_date'] = datetime.date(int(cert['issuance_date_year']), int(cert['issuance_date_month']), int(cert['issuance_date_day']))
-                    cert['expiry_date'] = datetime.date(int(cert['expiry_date_year']), int(cert['expiry_date_month']), int(cert['expiry_date_day']))
-                else:
-                    cert['issuance_date'] = None
-                    cert['expiry_date'] = None
+        if prefetch > 0:
+            pages = self.__prefetch_certificates_pages(prefetch)
+        else:
+            pages = self.__get_certificates_pages()
 
-                # convert to integer
-                cert['order_number'] = int(cert['order_number'])
+        for content in pages:
+            for cert in self._parse_certificates_page(content):
+                yield cert
 
-                # convert profile description to profile identifier
+    def find_certificates(self, keys, certificates=None, prefetch=0):
+        """
+        Looks up certificates by name, order number or id.
 
-                if cert['product'].endswith("SSL"):
-                    cert['profile'] = "server"
-                elif cert['product'].endswith("Client"):
-                    cert['profile'] = "client"
-                elif cert['product'].endswith("Code Signing"):
-                    cert['profile'] = "object"
-                else:
-                    cert['profile'] = None
+        The certificate list is ordered newest first, so the newest order of a name is found,
+        paging stops as soon as all keys have been found.
 
-                if cert['product'].startswith("Class"):
-                    cert['class'] = int(cert['product'][6])
-                else:
-                    cert['class'] = None
+        :param keys: names, order numbers or ids
+        :param certificates: entries to search instead of the certificate list (e.g. a CertificateIndex)
+        :param prefetch: see get_certificates_list()
+        :return: dict key (str) -> certificate entry, keys which weren't found are missing
+        """
+        pending = set(str(key) for key in keys)
+        found = {}
+        if certificates is None:
+            certificates = self.get_certificates_list(prefetch=prefetch)
+        for cert in certificates:
+            self._match_certificate(cert, pending, found)
+            if not pending:
+                break
+        if hasattr(certificates, 'close'):
+            certificates.close()  # stop paging (and prefetching)
+        return found
+
+    @staticmethod
+    def _match_certificate(cert, pending, found):
+        """
+        Moves the keys of cert (name, order number, id) from the pending set to the found dict
+        """
+        for key in (cert['name'], str(cert['order_number']), cert['id']):
+            if key in pending:
+                pending.discard(key)
+                found[key] = cert
 
-                item = self.RETRIEVE_CERTIFICATE_LIST_ACCTION_ID.search(cert['actions_code'])
-                if item != None:
-                    cert['id'] = item.group('orderId')
-                else:
-                    cert['id'] = None
-                del cert['actions_code']
-
-                """
-                # set retrieved state depending on the background color
-                if cert['color'] == "FFFFFF":
-                    cert['retrieved'] = True
-                else:  # if color = rgb(201, 255, 196)
-                    cert['retrieved'] = False
-                del cert['color']
-                """
-                yield cert
+    def __get_certificates_page(self, pageindex):
+        """
+        Returns the content of a CertList page
+        """
+        resp, content = self.__request(self._certificates_page_uri(pageindex), method="GET")
+        self._check_certificates_page(resp, content)
+        return content
+
+    def _certificates_page_uri(self, pageindex):
+        return self.STARTSSL_BASEURI+"/CertList?pageindex="+str(pageindex)
 
-            hasNextPage = ">Next page</a>" in content
+    @staticmethod
+    def _check_certificates_page(resp, content):
+        assert resp.status == 200, resp
+        assert "Certificate List<!--Cert List-->" in content, content
+
+    @staticmethod
+    def _has_next_page(content):
+        return ">Next page</a>" in content
+
+    def __get_certificates_pages(self):
+        """
+        Yields the content of all CertList pages, one page after another
+        """
+        hasNextPage = True
+        pageindex = 0
+        while hasNextPage:
+            content = self.__get_certificates_page(pageindex)
+            yield content
+
+            hasNextPage = self._has_next_page(content)
             pageindex += 1
 
+    def __prefetch_certificates_pages(self, depth):
+        """
+        Yields the content of all CertList pages.
+        The pages are fetched by a background thread which stays up to `depth` pages ahead of the consumer.
+        """
+        pages = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                for content in self.__get_certificates_pages():
+                    if not put(content):
+                        return
+                put(None)  # end of list
+            except Exception as e:
+                put(e)
+
+        fetcher = threading.Thread(target=fetch, name="CertList prefetch")
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            while True:
+                item = pages.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()  # the consumer is gone (exhausted, failed or closed), let the fetcher stop
+
+    @staticmethod
+    def _parse_certificates_page(content):
+        """
+        Yields the certificate entries of a CertList page
+        """
+        parser = CertificateListParser()
+        parser.feed(content)
+        parser.close()
+        for cert in parser.pop_certificates():
+            yield cert
 
     def get_certificate_zip(self, certificate_id):
         """
@@ -348,54 +1539,80 @@ class API(object):
         :return: ZIP file as bytes
         """
 
-        resp, content = self.__request(self.STARTSSL_BASEURI+"/CertList/DownLoadCert?orderId="+str(certificate_id), method="GET")
+        resp, content = self.__request(self._certificate_zip_uri(certificate_id), method="GET")
+        return self._check_certificate_zip(resp), content
+
+    def _certificate_zip_uri(self, certificate_id):
+        return self.STARTSSL_BASEURI+"/CertList/DownLoadCert?orderId="+str(certificate_id)
+
+    @staticmethod
+    def _check_certificate_zip(resp):
+        """
+        Checks the certificate zip bundle response and returns the attachment filename
+        """
         assert resp.status == 200, resp
         assert resp['content-type'] == 'application/octet-stream', resp
         assert resp['content-disposition'].startswith('attachment; filename='), resp
 
-        attachment_filename = resp['content-disposition'][len('attachment; filename='):]
-        return attachment_filename, content
-
+        return resp['content-disposition'][len('attachment; filename='):]
 
-    def get_certificate(self, certificate_id):
+    def get_certificate(self, certificate_id, target_dir=None):
         """
         Returns a certificate, it's basename (Common Name) and the corresponding intermediate certificate.
 
         Use get_certificates_list() to find the id or use the certificate_id returned by submit_certificate_request()
 
         :param certificate_id: StartSSL internal id of the certificate
+        :param target_dir: optional directory, the certificate files of the bundle are also written there
         :return: basename (common name), PEM encoded certificate
         """
 
         attachment_filename, zip_file = self.get_certificate_zip(certificate_id)
+        return self._extract_certificate(attachment_filename, zip_file, target_dir)
+
+    @staticmethod
+    def _extract_certificate(attachment_filename, zip_file, target_dir=None):
+        """
+        Extracts the certificate and the intermediate certificate from a certificate zip bundle.
+
+        Only the members which are needed are decompressed, once (reading a member verifies its CRC).
+        The bundle isn't copied, the zip file is read in place.
+
+        :param target_dir: optional directory, the certificate files of the bundle are also written there
+        :return: basename (common name), PEM encoded certificate, PEM encoded intermediate certificate
+        """
+        import zipfile
+
         assert attachment_filename[-4:] == ".zip", attachment_filename
         basename = attachment_filename[0:-4]
-        zf_main = zipfile.ZipFile(io.BytesIO(zip_file), "r")
-        assert zf_main.testzip() == None, "invalid zip file"
-
-        if "OtherServer.zip" in zf_main.namelist(): # Server
-            zf_server = zipfile.ZipFile(io.BytesIO(zf_main.read("OtherServer.zip")), "r")
-            intermediate_filename = "1_Intermediate.crt"
-            server_filename = "2_"+basename+".crt"
-
-            assert len(zf_server.namelist()) == 3, zf_server.namelist()
-            assert intermediate_filename in zf_server.namelist(), zf_server.namelist()
-            assert server_filename in zf_server.namelist(), zf_server.namelist()
-
-            intermediate_cert = zf_server.read(intermediate_filename).decode("ascii")
-            cert = zf_server.read(server_filename).decode("ascii")
-        elif len(zf_main.namelist()) == 2: # Client + Object
-            intermediate_filename = "1_Intermediate.crt"
-            cert_filename = zf_main.namelist()[1]
-            assert intermediate_filename != cert_filename, zf_main.namelist()
-
-            assert intermediate_filename in zf_main.namelist(), zf_main.namelist()
-            assert cert_filename in zf_main.namelist(), zf_main.namelist()
-
-            intermediate_cert = zf_main.read(intermediate_filename).decode("ascii")
-            cert = zf_main.read(cert_filename).decode("ascii")
-        else:
-            raise ValueError("unexpected zip content: "+str(zf_main.namelist()))
+        try:
+            zf_main = zipfile.ZipFile(io.BytesIO(zip_file), "r")
+
+            if "OtherServer.zip" in zf_main.namelist(): # Server
+                zf_certs = zipfile.ZipFile(io.BytesIO(zf_main.read("OtherServer.zip")), "r")
+                intermediate_filename = "1_Intermediate.crt"
+                cert_filename = "2_"+basename+".crt"
+
+                assert len(zf_certs.namelist()) == 3, zf_certs.namelist()
+            elif len(zf_main.namelist()) == 2: # Client + Object
+                zf_certs = zf_main
+                intermediate_filename = "1_Intermediate.crt"
+                cert_filename = zf_main.namelist()[1]
+                assert intermediate_filename != cert_filename, zf_main.namelist()
+            else:
+                raise ValueError("unexpected zip content: "+str(zf_main.namelist()))
+
+            assert intermediate_filename in zf_certs.namelist(), zf_certs.namelist()
+            assert cert_filename in zf_certs.namelist(), zf_certs.namelist()
+
+            members = {}
+            for filename in zf_certs.namelist() if target_dir else [intermediate_filename, cert_filename]:
+                members[filename] = zf_certs.read(filename)
+        except zipfile.BadZipfile as e:  # also raised on CRC errors
+            raise ValueError("invalid zip file: %s" % e)
+
+        intermediate_cert = members[intermediate_filename].decode("ascii")
+        cert = members[cert_filename].decode("ascii")
 
         assert "-----BEGIN CERTIFICATE-----" in intermediate_cert, "no BEGIN CERTIFICATE"
         assert "-----END CERTIFICATE-----" in intermediate_cert, "no END CERTIFICATE"
@@ -403,8 +1620,57 @@ class API(object):
         assert "-----BEGIN CERTIFICATE-----" in cert, "no BEGIN CERTIFICATE"
         assert "-----END CERTIFICATE-----" in cert, "no END CERTIFICATE"
 
+        if target_dir:
+            for filename, data in members.items():
+                _atomic_write(os.path.join(target_dir, os.path.basename(filename)), data, mode=0o644)
+
         return basename, cert, intermediate_cert
 
+    def get_certificates(self, certificates, jobs=4, store=None):
+        """
+        Retrieves multiple certificates concurrently.
+
+        The certificates iterable is consumed lazily (e.g. the output of get_certificates_list()),
+        so the list can still be paged while the first certificates are being downloaded.
+        At most `jobs` downloads are in flight at any time.
+
+        Yields a (certificate entry, result, error) tuple for each certificate in the input order.
+        result is the return value of get_certificate() or None if the download failed,
+        in which case error holds the exception.
+
+        :param certificates: iterable of certificate dicts (see get_certificates_list())
+        :param jobs: maximum number of concurrent downloads
+        :param store: optional CertificateStore, stored certificates are taken from it instead of being downloaded
+        :return: generator of (certificate, result, error) tuples
+        """
+        import concurrent.futures
+
+        assert jobs > 0, "jobs must be positive"
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for cert in certificates:
+                stored = store.get(cert['id']) if store is not None else None
+                if stored is not None:
+                    future = concurrent.futures.Future()  # queued like a download, so the input order is kept
+                    future.set_result(stored)
+                else:
+                    future = executor.submit(self.get_certificate, cert['id'])
+                pending.append((cert, future))
+                while len(pending) >= jobs:
+                    yield self.__pop_result(pending)
+            while pending:
+                yield self.__pop_result(pending)
+
+    @staticmethod
+    def __pop_result(pending):
+        """
+        Waits for the oldest pending download and returns its (certificate, result, error) tuple
+        """
+        cert, future = pending.popleft()
+        try:
+            return cert, future.result(), None
+        except Exception as e:
+            return cert, None, e
 
     def submit_certificate_request(self, profile, csr):
         """
@@ -424,40 +1690,571 @@ class API(object):
         self.get_validated_resources()
 
         if profile in ['server', 'xmpp']:
-            csr_cn = csr.get_common_name()
-            subjects = [csr_cn]
-            for t, v in csr.get_subject_alt_names(types=['dNSName']):
-                if v not in subjects:
-                    subjects.append(v)
-
-            assert len(subjects) > 0, "no subjects found"
-
-            subjects_direct = []
-            subjects_subdomain = []
-            validated_domain_first = None
-            for subject in subjects:
-                validated_domain = self.is_validated_domain(subject)
-                if validated_domain:
-                    if validated_domain not in subjects_direct:
-                        subjects_direct.append(validated_domain)
-                    if subject != validated_domain:
-                        subjects_subdomain.append(subject)
-
-                    if not validated_domain_first:
-                        validated_domain_first = validated_domain
-                else:
-                    raise ValueError("Missing domain validations for %s." % subject)
+            subjects = csr.get_subjects()
+            self.check_request_subjects(subjects)
+            self.__submit_csr(csr.get_pem(), subjects)
+
+    def check_request_subjects(self, subjects):
+        """
+        Makes sure all subjects of a certificate request are covered by domain validations.
 
-            assert len(subjects_direct) > 0, "no direct subjects identified."
+        :param subjects: common name and dNSName SubjectAltNames (see CSR.get_subjects())
+        :return: dict subject -> validated (parent) domain
+        :raises ValueError: if a subject isn't covered by a validated domain
+        """
+        self.get_validated_resources()
+        if self._stale_validations([subjects]):
+            self.get_validated_resources(force_update=True)
+        return self._check_request_subjects(subjects)
+
+    def _check_request_subjects(self, subjects):
+        """
+        Checks the subjects against the (already retrieved) validated domains, see check_request_subjects()
+        """
+        assert len(subjects) > 0, "no subjects found"
+
+        subjects_direct = []
+        subjects_subdomain = []
+        validated_domain_first = None
+        validated_domains = self.validated_domains_index.lookup_many(subjects)
+        for subject in subjects:
+            validated_domain = validated_domains[subject]
+            if validated_domain:
+                if validated_domain not in subjects_direct:
+                    subjects_direct.append(validated_domain)
+                if subject != validated_domain:
+                    subjects_subdomain.append(subject)
+
+                if not validated_domain_first:
+                    validated_domain_first = validated_domain
+            else:
+                raise ValueError("Missing domain validations for %s." % subject)
+
+        assert len(subjects_direct) > 0, "no direct subjects identified."
+        return validated_domains
+
+    def __submit_csr(self, pem, subjects):
+        """
+        Submits a PEM encoded CSR for the (already checked) subjects
+        """
+        resp, content = self.__request(self.STARTSSL_SUBMITCSR, method="POST", body=self._certificate_request_body(pem, subjects))
+        assert resp.status == 302, "CSR req is not redirecting"
+        resp, content = self.__request(self.STARTSSL_BASEURI + resp['location'], method="GET")
+        assert resp.status == 200, "second_step_certs bad status"
+
+    @staticmethod
+    def _certificate_request_body(pem, subjects):
+        return [('domains', "".join(subjects)), ('rbcsr', 'scsr'), ('areaCSR', pem), ('hidchekcer', '1'), ('__EVENTTARGET', 'btnSubmit')]
+
+    def submit_certificate_requests(self, profile, csrs, jobs=4, processes=None):
+        """
+        Submits a batch of CSRs.
+
+        The batch is processed in stages:
+        1. all CSRs are parsed in a process pool,
+        2. the subjects of all CSRs are checked against the validated domains (before anything is submitted),
+        3. the valid CSRs are submitted concurrently.
+
+        Returns a result dict for each CSR (in input order) with the keys:
+        'name', 'status' ('submitted', 'invalid' or 'failed'), 'error' (message or None), 'subjects',
+        'parse_time', 'submit_time' (seconds, None if the stage wasn't reached)
+
+        :param profile: the StartSSL profile which should be used (server or xmpp)
+        :param csrs: list of (name, PEM encoded CSR) tuples
+        :param jobs: maximum number of concurrent submissions
+        :param processes: number of CSR parser processes (default: number of CPUs, 1 parses in the current process)
+        :return: list of result dicts
+        :raises ValueError: if CSRs can't be submitted with the profile (only server and xmpp are supported)
+        """
+        assert profile in self.CERTIFICATE_PROFILES, "unknown profile"
+        assert jobs > 0, "jobs must be positive"
+        self._check_submission_profile(profile)
+
+        results = self._parse_certificate_requests(csrs, processes)
+        self.get_validated_resources()
+        if self._stale_validations(result['subjects'] for result in results if result['status'] is None):
+            self.get_validated_resources(force_update=True)
+        self._check_certificate_requests(results)
+
+        def submit(result, pem):
+            start = time.time()
+            try:
+                self.__submit_csr(pem, result['subjects'])
+                result['status'] = 'submitted'
+            except Exception as e:
+                result['status'] = 'failed'
+                result['error'] = str(e) or type(e).__name__
+            result['submit_time'] = time.time() - start
+
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for result, (name, pem) in zip(results, csrs):
+                if result['status'] is None:
+                    executor.submit(submit, result, pem)
+
+        return results
+
+    @staticmethod
+    def _check_submission_profile(profile):
+        if profile not in ('server', 'xmpp'):
+            raise ValueError("unsupported profile %s, only server and xmpp CSRs can be submitted" % profile)
+
+    @staticmethod
+    def _parse_certificate_requests(csrs, processes):
+        """
+        Parses a batch of CSRs in a process pool and returns the (initial) result dicts,
+        see submit_certificate_requests()
+        """
+        pems = [pem for name, pem in csrs]
+        if processes == 1 or len(pems) <= 1:
+            parsed = [_parse_csr_subjects(pem) for pem in pems]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                parsed = list(executor.map(_parse_csr_subjects, pems, chunksize=16))
+
+        results = []
+        for (name, pem), (subjects, error, parse_time) in zip(csrs, parsed):
+            results.append({'name': name, 'status': 'invalid' if error else None, 'error': error,
+                            'subjects': subjects, 'parse_time': parse_time, 'submit_time': None})
+        return results
+
+    def _check_certificate_requests(self, results):
+        """
+        Checks the subjects of the parsed CSRs against the (already retrieved) validated domains
+        """
+        for result in results:
+            if result['status'] is None:
+                try:
+                    self._check_request_subjects(result['subjects'])
+                except Exception as e:  # a single CSR never aborts the batch
+                    result['status'] = 'invalid'
+                    result['error'] = str(e) or type(e).__name__
+
+
+class ValidatedResourcesCache(object):
+    """
+    Validated resources shared by concurrent processes, stored as JSON file together with the DomainIndex table
+    (so loading needs no further processing). The entries expire after ttl seconds and are bound to the client
+    certificate they were fetched with.
+
+    Refreshes are serialized with an exclusive lock on <path>.lock, readers don't need the lock as the file
+    is replaced atomically.
+    """
+    VERSION = 1
+
+    def __init__(self, path, ttl=3600):
+        """
+        :param path: cache file, created on save() if it doesn't exist
+        :param ttl: seconds the validated resources are used
+        """
+        self.path = path
+        self.ttl = ttl
+
+    def load(self, account):
+        """
+        :param account: key of the account (e.g. the path of the client certificate)
+        :return: validated_emails, validated_domains, DomainIndex or None if the cache is missing, expired,
+                 incompatible or belongs to another account
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):  # missing or corrupt file
+            return None
+        if data.get('version') != self.VERSION or data.get('account') != account:
+            return None
+        if not 0 <= time.time() - data['updated'] < self.ttl:
+            return None
+        index = DomainIndex()
+        index.domains = data['index']
+        return data['emails'], data['domains'], index
+
+    def save(self, account, emails, domains, index):
+        """
+        Writes the cache file (atomically)
+        """
+        _atomic_write(self.path, json.dumps({'version': self.VERSION, 'account': account, 'updated': time.time(),
+                                             'emails': emails, 'domains': domains, 'index': index.domains}))
+
+    def invalidate(self):
+        """
+        Removes the cache file
+        """
+        try:
+            os.unlink(self.path)
+        except OSError:
+            if os.path.exists(self.path):
+                raise
+
+    def lock(self):
+        """
+        :return: the lock serializing refreshes (a context manager)
+        """
+        return _FileLock(self.path + ".lock")
+
+
+class CertificateIndex(object):
+    """
+    Persistent local index of the certificate list, stored as JSON file keyed by order number.
+
+    The index is synced incrementally from API.get_certificates_list():
+    StartSSL lists the newest orders first, so paging stops as soon as an already known order with an unchanged status
+    is reached, unless an older known order is still pending (it's revisited until it's issued, rejected, ...).
+    Listing and filtering can then be answered from the index.
+    """
+    VERSION = 1
+    DATE_KEYS = ('issuance_date', 'expiry_date')
+    PENDING_STATUSES = frozenset(["Pending"])  # orders which still change (no id and dates yet)
+
+    def __init__(self, path):
+        """
+        :param path: index file, created on save() if it doesn't exist
+        """
+        self.path = path
+        self.certificates = {}
+        self.keys = None  # name, order number and id -> entry, built on demand
+        self.load()
+
+    def load(self):
+        """
+        (Re)loads the index file, a missing, corrupt or incompatible file results in an empty index
+        """
+        self.certificates = {}
+        self.keys = None
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except ValueError:  # e.g. truncated, the next save() replaces it
+            return
+        if data.get('version') != self.VERSION:
+            return
+        for cert in data['certificates']:
+            for key in self.DATE_KEYS:
+                if cert[key] is not None:
+                    cert[key] = datetime.datetime.strptime(cert[key], "%Y-%m-%d").date()
+            self.certificates[cert['order_number']] = Certificate(**cert)
+
+    def save(self):
+        """
+        Writes the index file (atomically)
+        """
+        certificates = []
+        for cert in self:
+            cert = dict(cert)
+            for key in self.DATE_KEYS:
+                if cert[key] is not None:
+                    cert[key] = cert[key].isoformat()
+            certificates.append(cert)
+        _atomic_write(self.path, json.dumps({'version': self.VERSION, 'certificates': certificates}))
+
+    def sync(self, certificates, refresh=False):
+        """
+        Updates the index from the certificate list.
+
+        :param certificates: iterable of certificate dicts (see API.get_certificates_list()),
+                             only consumed up to the first known entry with an unchanged status which is older than
+                             all known pending orders
+        :param refresh: consume the whole list and replace the index (drops orders which are no longer listed)
+        :return: number of new or changed entries
+        """
+        changed = 0
+        synced = {}
+        pending = [order_number for order_number, cert in self.certificates.items()
+                   if cert['status'] in self.PENDING_STATUSES]
+        oldest_pending = min(pending) if pending else None
+        for cert in certificates:
+            known = self.certificates.get(cert['order_number'])
+            if (known is not None and known['status'] == cert['status'] and not refresh and
+                    (oldest_pending is None or cert['order_number'] < oldest_pending)):
+                break  # everything from here on is already known and final
+            if known != cert:
+                changed += 1
+            synced[cert['order_number']] = cert
+        if hasattr(certificates, 'close'):
+            certificates.close()  # stop paging (and prefetching)
+
+        if refresh:
+            self.certificates = synced
+        else:
+            # the list was consumed past all pending orders, those which weren't seen are no longer listed
+            for order_number in pending:
+                if order_number not in synced:
+                    del self.certificates[order_number]
+                    changed += 1
+            self.certificates.update(synced)
+        self.keys = None
+        return changed
+
+    def lookup(self, key):
+        """
+        Returns the entry with the name (newest order), order number or id key or None
+        """
+        if self.keys is None:
+            keys = {}
+            for cert in self.certificates.values():
+                keys[str(cert['order_number'])] = keys[cert['id']] = cert
+                newest = keys.get(cert['name'])
+                if newest is None or newest['order_number'] < cert['order_number']:
+                    keys[cert['name']] = cert
+            self.keys = keys
+        return self.keys.get(str(key))
+
+    def is_final(self, cert):
+        """
+        Returns True if the entry has an id and a status which doesn't change any more (e.g. not pending)
+        """
+        return cert is not None and cert['id'] is not None and cert['status'] not in self.PENDING_STATUSES
+
+    def __iter__(self):
+        """
+        Yields the certificate entries, newest order first (like the certificate list)
+        """
+        for order_number in sorted(self.certificates, reverse=True):
+            yield self.certificates[order_number]
+
+    def __len__(self):
+        return len(self.certificates)
+
+
+class CertificateStore(object):
+    """
+    Content addressed local certificate store.
+
+    Certificates and intermediate certificates are stored once per SHA-256 fingerprint (of the DER encoding)
+    as objects/<fingerprint[:2]>/<fingerprint>.pem, so the intermediate certificate shared by many orders
+    is only stored once. An index (orders.json) maps the StartSSL certificate ids to the fingerprints.
+    All files are written atomically, get() verifies the fingerprints so a damaged object counts as missing.
+    """
+    VERSION = 1
+    PEM = _LazyRegex(r'-----BEGIN CERTIFICATE-----([A-Za-z0-9+/=\s]*)-----END CERTIFICATE-----')
+
+    def __init__(self, path):
+        """
+        :param path: store directory, created if it doesn't exist
+        """
+        self.path = path
+        self.orders = {}  # certificate id -> dict with 'order_number', 'name', 'certificate', 'intermediate'
+        self.fingerprints = {}  # certificate fingerprint -> certificate id
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        self.load()
+
+    @classmethod
+    def fingerprint(cls, pem):
+        """
+        Returns the SHA-256 fingerprint (hex) of a PEM encoded certificate
+        """
+        import hashlib
+
+        matches = cls.PEM.search(pem)
+        if not matches:
+            raise ValueError("Not a PEM certificate")
+        return hashlib.sha256(base64.b64decode(matches.group(1))).hexdigest()
+
+    def load(self):
+        """
+        (Re)loads the index, a missing, corrupt or incompatible index results in an empty store
+        (the objects are kept, orders stored again find them in place)
+        """
+        self.orders = {}
+        index = os.path.join(self.path, "orders.json")
+        if os.path.exists(index):
+            try:
+                with open(index, 'r') as f:
+                    data = json.load(f)
+            except ValueError:  # e.g. truncated, the next save() replaces it
+                data = {}
+            if data.get('version') == self.VERSION:
+                self.orders = data['orders']
+        self.fingerprints = dict((order['certificate'], id) for id, order in self.orders.items())
+
+    def save(self):
+        """
+        Writes the index (atomically)
+        """
+        _atomic_write(os.path.join(self.path, "orders.json"),
+                      json.dumps({'version': self.VERSION, 'orders': self.orders}, sort_keys=True))
+
+    def __object_path(self, fingerprint):
+        return os.path.join(self.path, "objects", fingerprint[:2], fingerprint + ".pem")
+
+    def __read_object(self, fingerprint):
+        """
+        Returns the PEM of an object or None if it's missing or damaged
+        """
+        try:
+            with open(self.__object_path(fingerprint), 'r') as f:
+                pem = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            return pem if self.fingerprint(pem) == fingerprint else None
+        except (TypeError, ValueError):  # not base64 (the error type depends on the python version)
+            return None
+
+    def __write_object(self, pem):
+        """
+        Stores a certificate (unless it's already stored intact) and returns its fingerprint
+        """
+        fingerprint = self.fingerprint(pem)
+        path = self.__object_path(fingerprint)
+        if self.__read_object(fingerprint) is None:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), 0o700)
+            _atomic_write(path, pem, mode=0o644)
+        return fingerprint
+
+    def add(self, cert, certificate, intermediate_cert):
+        """
+        Stores the certificate of an order.
+
+        :param cert: certificate dict (see API.get_certificates_list())
+        :param certificate: PEM encoded certificate
+        :param intermediate_cert: PEM encoded intermediate certificate
+        :return: fingerprint of the certificate
+        """
+        fingerprint = self.__write_object(certificate)
+        self.orders[cert['id']] = {
+            'order_number': cert['order_number'], 'name': cert['name'],
+            'certificate': fingerprint, 'intermediate': self.__write_object(intermediate_cert),
+        }
+        self.fingerprints[fingerprint] = cert['id']
+        return fingerprint
+
+    def get(self, certificate_id):
+        """
+        Returns the stored certificate of an order as (basename, certificate, intermediate certificate) tuple
+        like API.get_certificate() or None if it isn't (intact) in the store
+        """
+        order = self.orders.get(certificate_id)
+        if order is None:
+            return None
+        certificate = self.__read_object(order['certificate'])
+        intermediate_cert = self.__read_object(order['intermediate'])
+        if certificate is None or intermediate_cert is None:
+            return None
+        return order['name'], certificate, intermediate_cert
+
+    def find(self, fingerprint):
+        """
+        Returns the certificate id of the order with the certificate fingerprint or None
+        """
+        return self.fingerprints.get(fingerprint.lower().replace(":", ""))
+
+    def __contains__(self, certificate_id):
+        return certificate_id in self.orders
+
+    def __len__(self):
+        return len(self.orders)
+
+
+class RenewalPlanner(object):
+    """
+    Expiry index of the certificate list for renewal planning.
+
+    Only the newest order of each name and profile is considered (an older order counts as renewed, even if the newer
+    one is still pending), revoked/rejected orders and orders without expiry date are left out.
+    The entries are kept sorted by expiry date, so due() takes O(log n + k) for k due certificates.
+    """
+    EXCLUDED_STATUSES = frozenset(["Revoked", "Rejected"])
+
+    def __init__(self, certificates):
+        """
+        :param certificates: iterable of certificate dicts (see API.get_certificates_list() and CertificateIndex)
+        """
+        newest = {}
+        for cert in certificates:
+            key = (cert['profile'], DomainIndex.normalize(cert['name']))
+            if key not in newest or newest[key]['order_number'] < cert['order_number']:
+                newest[key] = cert
+        entries = sorted(((cert['expiry_date'], cert['order_number']), cert) for cert in newest.values()
+                         if cert['expiry_date'] is not None and cert['status'] not in self.EXCLUDED_STATUSES)
+        self.keys = [key for key, cert in entries]
+        self.certificates = [cert for key, cert in entries]
+
+    def due(self, days, today=None):
+        """
+        Returns the certificates which expire within the next days (or already expired), earliest expiry first.
+
+        :param days: planning horizon in days
+        :param today: reference date (default: today)
+        """
+        today = today or datetime.date.today()
+        end = bisect.bisect_right(self.keys, (today + datetime.timedelta(days=days), float("inf")))
+        return self.certificates[:end]
+
+    def expiring_between(self, start, end):
+        """
+        Returns the certificates which expire between the dates start and end (inclusive), earliest expiry first.
+        """
+        return self.certificates[bisect.bisect_left(self.keys, (start,)):bisect.bisect_right(self.keys, (end, float("inf")))]
+
+    @staticmethod
+    def match_csrs(certificates, csrs):
+        """
+        Matches certificates to CSRs by common name (case insensitive, the last CSR by filename wins).
+        CSRs without common name are ignored.
+
+        :param certificates: iterable of certificate dicts
+        :param csrs: list of CSR instances (see CSR.load_many())
+        :return: list of (certificate, CSR or None) tuples in the order of certificates
+        """
+        by_name = dict((DomainIndex.normalize(csr.get_common_name()), csr) for csr in csrs if csr.get_common_name())
+        return [(cert, by_name.get(DomainIndex.normalize(cert['name']))) for cert in certificates]
+
+    def __len__(self):
+        return len(self.certificates)
+
+
+class RenewalBudget(object):
+    """
+    Daily limit of renewal submissions, the number submitted today is kept in a JSON file across runs.
+    """
+
+    def __init__(self, path, per_day):
+        """
+        :param path: state file (None keeps the state in memory only, a corrupt file counts as nothing submitted)
+        :param per_day: maximum number of submissions per day (0 means unlimited)
+        """
+        self.path = path
+        self.per_day = per_day
+        self.day = datetime.date.today().isoformat()
+        self.submitted = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    state = json.load(f)
+            except ValueError:  # e.g. truncated, the next save() replaces it
+                state = {}
+            if state.get('day') == self.day:
+                self.submitted = state['submitted']
+
+    def remaining(self):
+        """
+        Returns the number of submissions left today (None if unlimited)
+        """
+        if not self.per_day:
+            return None
+        return max(0, self.per_day - self.submitted)
+
+    def spend(self, count=1):
+        self.submitted += count
+
+    def save(self):
+        """
+        Writes the state file (atomically)
+        """
+        if self.path:
+            _atomic_write(self.path, json.dumps({'day': self.day, 'submitted': self.submitted}))
 
-            # submit CSR
-            body = [('domains', "".join(subjects)), ('rbcsr', 'scsr'), ('areaCSR', csr.get_pem()), ('hidchekcer', '1'), ('__EVENTTARGET', 'btnSubmit')]
-            resp, content = self.__request(self.STARTSSL_SUBMITCSR, method="POST", body=body)
-            assert resp.status == 302, "CSR req is not redirecting"
-            resp, content = self.__request(self.STARTSSL_BASEURI + resp['location'], method="GET")
-            assert resp.status == 200, "second_step_certs bad status"
 
 if __name__ == "__main__":
+    def iso_date(value):
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
     config_files = ['/etc/startssl.conf', 'startssl.conf']
     parser = argparse.ArgumentParser(prog="StartSSL_API", description="A CLI for some StartSSL functions.", fromfile_prefix_chars='@', epilog="Arguments are also read from the following config files: %s (use @/path/to/file to specify more files)" % ", ".join(config_files))
     parser.add_argument('--ca_certs', help='CA certificate file (PEM) to authenticate the server (default: %(default)s',
@@ -466,6 +2263,14 @@ if __name__ == "__main__":
                         type=argparse.FileType('r'))
     parser.add_argument('--client_key', help='Client key file (PEM)', required=True, type=argparse.FileType('r'))
     parser.add_argument('--user_agent', help='HTTP User Agent to use', default="StartSSL_API/%s (+https://github.com/freddy36/StartSSL_API)" % __version__, type=str)
+    parser.add_argument('--connections', help='Maximum number of concurrent requests/keep-alive connections (default: %(default)s)', default=8, type=int)
+    parser.add_argument('--retries', help='Maximum number of retries of transiently failed requests (default: %(default)s, 0 disables retries)', default=4, type=int)
+    parser.add_argument('--cache_dir', help='Directory for persistent caches (e.g. the certificate list index), disabled by default', default=None, type=str)
+    parser.add_argument('--session_ttl', help='Seconds the session is reused by later runs, requires --cache_dir (default: %(default)s, 0 disables the session cache)', default=3600, type=int)
+    parser.add_argument('--validated_ttl', help='Seconds the validated domains/emails are reused by later runs, requires --cache_dir (default: %(default)s, 0 disables the cache)', default=3600, type=int)
+    parser.add_argument('--refresh_validated', help='Drop the cached validated domains/emails (e.g. after validating a new domain)', action='store_true')
+    parser.add_argument('--stats', help='Print request statistics to stderr at exit', action='store_true')
+    parser.add_argument('--stats_format', help='Format of the request statistics (default: %(default)s)', choices=['text', 'json', 'prometheus'], default='text')
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
 
     subparsers = parser.add_subparsers(title='subcommands',
@@ -474,6 +2279,12 @@ if __name__ == "__main__":
     parser_csr.set_defaults(cmd="csr")
     parser_csr.add_argument('--profile', choices=['server', 'xmpp'], help='StartSSL profile', default="server",
                             type=str)
+    parser_csr.add_argument('--jobs', default=1, type=int,
+                            help="number of CSRs submitted concurrently (default: %(default)s)")
+    parser_csr.add_argument('--parse_processes', default=0, type=int,
+                            help="number of CSR parser processes, 0 uses one per CPU (default: %(default)s)")
+    parser_csr.add_argument('--summary', default=None, type=str,
+                            help="write a JSON summary (status, error and timings per file) to this file, use - for stdout")
     parser_csr.add_argument('csr_files', nargs=argparse.REMAINDER, type=argparse.FileType('r'), help="CSR files (PEM)")
     parser_certs = subparsers.add_parser('certs', help='Retrieves signed certificates',
                                          description='Retrieves certificates from StartSSL. By default all available certificates are listed.')
@@ -483,53 +2294,226 @@ if __name__ == "__main__":
     parser_certs.add_argument('--list_format',
                               default="Order Number: {order_number}, {name}, Profile: {profile}, Class: {class}, Product: {product}, Status: {status}, Issuance date: {issuance_date}, Expiry date: {expiry_date}, id: {id}",
                               type=str, help="default: %(default)s")
+    parser_certs.add_argument('--output', choices=['text', 'jsonl', 'csv'], default='text',
+                              help="list format: text (see --list_format), jsonl (one JSON object per line) or csv (default: %(default)s)")
+    parser_certs.add_argument('--fields', default=",".join(Certificate.FIELDS), type=str,
+                              help="comma separated fields for --output jsonl/csv (default: %(default)s)")
+    parser_certs.add_argument('--status', action="append", default=[],
+                              help="only certificates with this status (e.g. Issued), can be given multiple times")
+    parser_certs.add_argument('--profile', action="append", default=[], choices=['server', 'client', 'object'],
+                              help="only certificates with this profile, can be given multiple times")
+    parser_certs.add_argument('--expires_after', type=iso_date, help="only certificates which expire on or after this date (YYYY-MM-DD)")
+    parser_certs.add_argument('--expires_before', type=iso_date, help="only certificates which expire on or before this date (YYYY-MM-DD)")
+    parser_certs.add_argument('--jobs', default=1, type=int,
+                              help="number of certificates downloaded concurrently (default: %(default)s)")
+    parser_certs.add_argument('--prefetch', default=1, type=int,
+                              help="number of certificate list pages fetched ahead in the background, 0 disables prefetching (default: %(default)s)")
+    parser_certs.add_argument('--refresh', action='store_true',
+                              help="resync the whole certificate list index instead of only the new/changed orders (requires --cache_dir)")
     parser_certs.add_argument('--filename_format', default="{name}.crt", type=str,
                               help="default: %(default)s, use - for stdout")
     parser_certs.add_argument('certificates', nargs=argparse.REMAINDER,
-                              help="Retrieve specific certificates by name or id", type=str)
+                              help="Retrieve specific certificates by name, order number or id", type=str)
+    parser_renew = subparsers.add_parser('renew', help='Resubmits the CSRs of expiring certificates',
+                                         description='Resubmits the CSRs (matched by common name) of the certificates which expire within the next days, earliest expiry first.')
+    parser_renew.set_defaults(cmd="renew")
+    parser_renew.add_argument('--csr_dir', required=True, type=str,
+                              help="directory with the CSR files (*.csr) or glob pattern")
+    parser_renew.add_argument('--days', default=30, type=int,
+                              help="renew certificates which expire within this many days (default: %(default)s)")
+    parser_renew.add_argument('--budget', default=0, type=int,
+                              help="maximum number of renewals submitted per day, tracked across runs with --cache_dir (default: %(default)s, 0 means unlimited)")
+    parser_renew.add_argument('--jobs', default=1, type=int,
+                              help="number of CSRs submitted concurrently (default: %(default)s)")
+    parser_renew.add_argument('--prefetch', default=1, type=int,
+                              help="number of certificate list pages fetched ahead in the background, 0 disables prefetching (default: %(default)s)")
+    parser_renew.add_argument('--refresh', action='store_true',
+                              help="resync the whole certificate list index instead of only the new/changed orders (requires --cache_dir)")
+    parser_renew.add_argument('--dry_run', action='store_true',
+                              help="only print the renewal plan")
+    parser_serve = subparsers.add_parser('serve', help='Serves the API to local clients',
+                                         description='Keeps an authenticated session, the certificate list and the validated resources warm and serves them as JSON over HTTP on a Unix socket (accessible by the owner only): '
+                                                     'GET /certificates, GET /certificates/<id, order number or name>, GET /validated, POST /csr ({"profile": "server", "csrs": [{"name": ..., "csr": PEM}]}), GET /status')
+    parser_serve.set_defaults(cmd="serve")
+    parser_serve.add_argument('--socket', required=True, type=str, help="path of the Unix socket")
+    parser_serve.add_argument('--ttl', default=300, type=int,
+                              help="seconds the certificate list and the validated resources are cached (default: %(default)s)")
+    parser_serve.add_argument('--jobs', default=4, type=int,
+                              help="number of CSRs submitted concurrently per request (default: %(default)s)")
+    parser_serve.add_argument('--verbose', action='store_true', help="log each request to stderr")
     args_src = []
     for config_file in config_files:
         if os.path.exists(config_file):
             args_src.append("@"+config_file)
     args_src += sys.argv[1:]
     args = parser.parse_args(args=args_src)
-
-    api = API(ca_certs=args.ca_certs.name, user_agent=args.user_agent)
-    api.authenticate(args.client_crt.name, args.client_key.name)
     if args.cmd == "certs":
-        certs = api.get_certificates_list()
+        args.fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+        for field in args.fields:
+            try:
+                Certificate()[field]
+            except KeyError:
+                parser.error("unknown field %s" % field)
+
+    exit_code = 0
+    if args.cache_dir and not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir, 0o700)
+    api = API(ca_certs=args.ca_certs.name, user_agent=args.user_agent, connections=args.connections, retries=args.retries)
+    if args.stats:
+        metrics = Metrics()
+        api.add_request_hook(metrics)
+        atexit.register(lambda: print({'text': metrics.summary, 'json': metrics.to_json, 'prometheus': metrics.to_prometheus}[args.stats_format](), file=sys.stderr))
+    session_file = None
+    if args.cache_dir and args.session_ttl > 0:
+        session_file = os.path.join(args.cache_dir, "session.json")
+    api.authenticate(args.client_crt.name, args.client_key.name, session_file=session_file, session_ttl=args.session_ttl)
+    if args.cache_dir and args.validated_ttl > 0:
+        api.validated_cache = ValidatedResourcesCache(os.path.join(args.cache_dir, "validated.json"), args.validated_ttl)
+    if args.refresh_validated:
+        api.invalidate_validated_resources()
+    if args.cmd in ("certs", "renew"):
+        index = CertificateIndex(os.path.join(args.cache_dir, "certificates.json")) if args.cache_dir else None
+        targeted = args.cmd == "certs" and args.certificates and not args.store
+        if targeted and index is not None and not args.refresh and \
+                all(index.is_final(index.lookup(key)) for key in args.certificates):
+            certs = [index.lookup(key) for key in args.certificates]  # all known and final, no need to list anything
+        else:
+            certs = api.get_certificates_list(prefetch=args.prefetch)
+            if index is not None:
+                index.sync(certs, refresh=args.refresh)
+                index.save()
+                certs = iter(index)
+            if targeted:
+                found = api.find_certificates(args.certificates, certs)  # stops paging once all are found
+                for key in args.certificates:
+                    if key not in found:
+                        print("Certificate %s not found" % key, file=sys.stderr)
+                        exit_code = 1
+                certs = [found[key] for key in args.certificates if key in found]
+        if targeted:
+            certs = list(collections.OrderedDict((cert['order_number'], cert) for cert in certs).values())  # unique
+    if args.cmd == "certs":
+        certs = filter_certificates(certs, status=args.status, profile=args.profile,
+                                    expires_after=args.expires_after, expires_before=args.expires_before)
         if not args.store and not args.certificates:
-            for cert in certs:
-                print(args.list_format.format(**cert))
+            if args.output == "text":
+                for cert in certs:
+                    print(cert.format(args.list_format))
+            else:
+                write_certificates(certs, sys.stdout, args.output, args.fields)
         else:
-            for cert in certs:
-                filename = args.filename_format.format(**cert)
-                if (("all" in args.store) or
-                        ("new" in args.store and not cert['retrieved']) or
-                        ("missing" in args.store and not os.path.exists(filename)) or
-                        (cert['name'] in args.certificates) or
-                        (str(cert['order_number']) in args.certificates)):
-                    basename, cert, intermediate_cert = api.get_certificate(cert['id'])
-                    if filename == "-":
-                        print(cert)
-                    else:
-                        f = open(filename, 'w')
-                        f.write(cert)
-                        f.close()
-                        print("stored", filename)
-    elif args.cmd == "csr":
-        for csr_file in args.csr_files:
-            try:
-                print("Submitting %s" % csr_file.name)
-                csr = CSR(csr_file)
-                api.submit_certificate_request(profile=args.profile, csr=csr)
-
-                print("Submission successful;")
-
-            except ValueError as e:
-                print("Submission failed:", e)
-            except Exception as e:
-                print("Submission failed:")
-                print(traceback.format_exc(), file=sys.stderr)
+            store = CertificateStore(os.path.join(args.cache_dir, "store")) if args.cache_dir else None
+
+            def store_certificate(cert, certificate):
+                filename = cert.format(args.filename_format)
+                if filename == "-":
+                    print(certificate)
+                    return
+                if os.path.exists(filename):
+                    with open(filename, 'r') as f:
+                        if f.read() == certificate:
+                            print("unchanged", filename)
+                            return
+                _atomic_write(filename, certificate, mode=0o644)
+                print("stored", filename)
+
+            wanted = set(args.certificates)
+
+            def downloads():
+                queued = set()  # renewals keep the name, only the first (newest) order of a target file is retrieved
+                for cert in certs:
+                    filename = cert.format(args.filename_format)
+                    if filename != "-" and filename in queued:
+                        continue
+                    if (("all" in args.store) or
+                            ("new" in args.store and not cert['retrieved']) or
+                            ("missing" in args.store and not os.path.exists(filename)) or
+                            (cert['name'] in wanted) or
+                            (str(cert['order_number']) in wanted) or
+                            (cert['id'] in wanted)):
+                        queued.add(filename)
+                        yield cert
 
-    sys.exit(0)
+            try:
+                # stored orders aren't downloaded again
+                for cert, result, error in api.get_certificates(downloads(), jobs=args.jobs, store=store):
+                    if error is not None:
+                        print("Retrieving %s failed: %s" % (cert['name'], error), file=sys.stderr)
+                        exit_code = 1
+                        continue
+                    basename, certificate, intermediate_cert = result
+                    if store is not None and cert['id'] not in store:
+                        store.add(cert, certificate, intermediate_cert)
+                    store_certificate(cert, certificate)
+            finally:
+                if store is not None:
+                    store.save()
+    elif args.cmd == "csr":
+        csrs = [(csr_file.name, csr_file.read()) for csr_file in args.csr_files]
+        results = api.submit_certificate_requests(args.profile, csrs, jobs=args.jobs, processes=args.parse_processes or None)
+        for result in results:
+            if result['status'] == 'submitted':
+                print("Submission of %s successful;" % result['name'])
+            else:
+                print("Submission of %s failed: %s" % (result['name'], result['error']))
+                exit_code = 1
+
+        if args.summary:
+            summary = json.dumps(results, indent=2, sort_keys=True)
+            if args.summary == "-":
+                print(summary)
+            else:
+                _atomic_write(args.summary, summary + "\n", mode=0o644)
+    elif args.cmd == "renew":
+        budget = RenewalBudget(os.path.join(args.cache_dir, "renewals.json") if args.cache_dir else None, args.budget)
+        remaining = budget.remaining()
+
+        errors = []
+        csrs = CSR.load_many(args.csr_dir, errors=errors)
+        errors.extend((csr.filename, "no common name") for csr in csrs if not csr.get_common_name())
+        for filename, error in sorted(errors):
+            print("Skipping %s: %s" % (filename, error), file=sys.stderr)
+            exit_code = 1
+
+        plan = []
+        for cert, csr in RenewalPlanner.match_csrs(RenewalPlanner(certs).due(args.days), csrs):
+            if csr is None:
+                print("No CSR for %s (expires %s)" % (cert['name'], cert['expiry_date']), file=sys.stderr)
+                exit_code = 1
+            elif cert['profile'] not in ('server', 'xmpp'):
+                print("Can't renew %s, profile %s isn't supported" % (cert['name'], cert['profile']), file=sys.stderr)
+                exit_code = 1
+            elif remaining is not None and len(plan) >= remaining:
+                print("Daily budget exhausted, postponing %s (expires %s)" % (cert['name'], cert['expiry_date']))
+            else:
+                plan.append((cert, csr))
+
+        for cert, csr in plan:
+            print("Renewing %s (expires %s) with %s" % (cert['name'], cert['expiry_date'], csr.filename))
+        if not args.dry_run:
+            for profile in sorted(set(cert['profile'] for cert, csr in plan)):
+                csrs = [(csr.filename, csr.get_pem()) for cert, csr in plan if cert['profile'] == profile]
+                for result in api.submit_certificate_requests(profile, csrs, jobs=args.jobs, processes=1):
+                    if result['status'] == 'submitted':
+                        budget.spend()
+                        print("Submission of %s successful;" % result['name'])
+                    else:
+                        print("Submission of %s failed: %s" % (result['name'], result['error']))
+                        exit_code = 1
+            budget.save()
+    elif args.cmd == "serve":
+        sys.modules.setdefault('startssl', sys.modules[__name__])  # don't load this file a second time as module
+        from startssl_server import APIServer
+
+        index = CertificateIndex(os.path.join(args.cache_dir, "certificates.json")) if args.cache_dir else None
+        try:
+            server = APIServer(api, args.socket, index=index, ttl=args.ttl, jobs=args.jobs, verbose=args.verbose)
+        except ValueError as e:
+            parser.error(str(e))
+        server.get_validated_resources()
+        server.get_certificates_list()
+        print("Serving on %s" % args.socket)
+        sys.stdout.flush()
+        server.serve_forever()
+
+    sys.exit(exit_code)
@@ -0,0 +1,495 @@
+# -*- coding: UTF-8 -*-
+
+"""
+asyncio version of the StartSSL API (python >= 3.6).
+
+AsyncAPI mirrors startssl.API, all request/response handling (headers, checks, parsing) is shared with it,
+only the HTTP transport is replaced by a small asyncio HTTP/1.1 client with keep-alive connections.
+Many operations can run concurrently on one event loop, e.g.:
+
+    api = AsyncAPI(ca_certs="/etc/ssl/certs/StartCom_Certification_Authority.pem")
+    await api.authenticate("client.crt", "client.key")
+    certificates = await asyncio.gather(*[api.get_certificate(cert['id'])
+                                          async for cert in api.get_certificates_list()])
+    api.close()
+
+License: LGPL 2.1 or later, see startssl.py
+"""
+
+import asyncio
+import collections
+import ssl
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from startssl import API, RECEIVED_LENGTH, RequestScheduler
+
+
+class _Response(dict):
+    """
+    httplib2.Response look-alike: dict of the (lower case) response headers with a status attribute
+    """
+
+    def __init__(self, status, reason, headers):
+        dict.__init__(self, headers)
+        self.status = status
+        self.reason = reason
+
+
+class AsyncHTTP(object):
+    """
+    Minimal asyncio HTTP/1.1 client with keep-alive connections (one pool per host).
+    """
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+    def __init__(self, ca_certs=None, max_connections=10):
+        """
+        :param ca_certs: PEM encoded CA certificate file to authenticate the server
+        :param max_connections: maximum number of concurrent requests (and open connections)
+        """
+        self.ca_certs = ca_certs
+        self.max_connections = max_connections
+        self.client_certificate = None
+        self.idle = collections.defaultdict(list)  # (scheme, host, port) -> [(reader, writer)]
+        self.__ssl_context = None
+        self.__semaphore = None
+
+    def add_certificate(self, key, cert):
+        """
+        Use a client certificate for all https connections
+        """
+        self.client_certificate = (key, cert)
+        self.__ssl_context = None
+
+    def ssl_context(self):
+        if self.__ssl_context is None:
+            context = ssl.create_default_context(cafile=self.ca_certs)
+            if self.client_certificate:
+                key, cert = self.client_certificate
+                context.load_cert_chain(cert, key)
+            self.__ssl_context = context
+        return self.__ssl_context
+
+    async def request(self, uri, method="GET", body=None, headers=None):
+        """
+        Sends a request, redirects aren't followed.
+
+        :return: response (dict of headers with a status attribute), content (bytes)
+        """
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_connections)
+
+        url = urlsplit(uri)
+        key = (url.scheme, url.hostname, url.port or self.DEFAULT_PORTS[url.scheme])
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = dict(headers or {})
+        if not any(name.lower() == "accept-encoding" for name in headers):
+            headers["Accept-Encoding"] = "gzip, deflate"
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % url.netloc]
+        for name, value in headers.items():
+            lines.append("%s: %s" % (name, value))
+        if body is not None:
+            lines.append("Content-Length: %d" % len(body))
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + (body or b"")
+
+        async with self.__semaphore:
+            while True:
+                reused = bool(self.idle[key])
+                reader, writer = await self.__connect(key)
+                try:
+                    writer.write(request)
+                    resp, content, keep_alive = await self.__read_response(reader, method)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue  # the server closed the idle connection, retry with a new one
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+
+        if keep_alive:
+            self.idle[key].append((reader, writer))
+        else:
+            writer.close()
+        resp.connection_reused = reused
+        resp[RECEIVED_LENGTH] = str(len(content))
+
+        encoding = resp.get("content-encoding")
+        if encoding in ("gzip", "deflate"):
+            # like httplib2: the original encoding is kept as -content-encoding
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS)
+            resp["-content-encoding"] = resp.pop("content-encoding")
+            resp["content-length"] = str(len(content))
+        return resp, content
+
+    async def __connect(self, key):
+        if self.idle[key]:
+            return self.idle[key].pop()
+        scheme, host, port = key
+        return await asyncio.open_connection(host, port, ssl=self.ssl_context() if scheme == "https" else None)
+
+    @staticmethod
+    async def __read_response(reader, method):
+        status_line = (await reader.readuntil(b"\r\n")).decode('latin-1').rstrip("\r\n")
+        version, status, reason = (status_line.split(" ", 2) + [""])[:3]
+
+        headers = {}
+        while True:
+            line = (await reader.readuntil(b"\r\n")).decode('latin-1').rstrip("\r\n")
+            if not line:
+                break
+            name, value = line.split(":", 1)
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + ", " + value if name in headers else value  # like httplib2
+        resp = _Response(int(status), reason, headers)
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or resp.status in (204, 304) or 100 <= resp.status < 200:
+            content = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readuntil(b"\r\n")) != b"\r\n":  # trailers
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await reader.read()
+            keep_alive = False
+        return resp, content, keep_alive
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class AsyncRequestScheduler(RequestScheduler):
+    """
+    RequestScheduler for coroutines, acquire() waits without blocking the event loop.
+    """
+
+    def retry_errors(self):
+        return (asyncio.TimeoutError, TimeoutError, ConnectionResetError, ConnectionAbortedError, BrokenPipeError,
+                asyncio.IncompleteReadError)
+
+    async def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class AsyncAPI(API):
+    """
+    asyncio version of API, all API calls are coroutines (get_certificates_list() is an async generator).
+    """
+
+    def __init__(self, ca_certs=API.STARTCOM_CA, user_agent=None, max_connections=10, retries=4):
+        """
+        Init the StartSSL API.
+
+        :param ca_certs: PEM encoded CA certificate file to authenticate the server
+        :param max_connections: maximum number of concurrent requests
+        :param retries: maximum number of retries of transiently failed requests (0 disables retries)
+        """
+        API.__init__(self, ca_certs=ca_certs, user_agent=user_agent)
+        self.http = AsyncHTTP(ca_certs=ca_certs, max_connections=max_connections)
+        self.scheduler = AsyncRequestScheduler(concurrency=max_connections, retries=retries)
+        self.__session_lock = None
+
+    async def _request(self, uri, **kwargs):
+        """
+        Wrapper for HTTP requests
+        """
+        self._prepare_request(kwargs)
+
+        resp, content = await self.__send(uri, **kwargs)
+        if self.authenticated and uri != self.STARTSSL_AUTHURI and self._session_rejected(resp):
+            # the session is no longer valid (an expired cached session or the session of a long running process),
+            # fall back to client certificate authentication and retry
+            await self.__reauthenticate(kwargs['headers'].get('Cookie'))
+            kwargs['headers']['Cookie'] = self.cookies
+            resp, content = await self.__send(uri, **kwargs)
+
+        return resp, self._decode_content(resp, content)
+
+    async def __send(self, uri, **kwargs):
+        method = kwargs.get('method', "GET")
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.scheduler.acquire()
+            resp = content = error = None
+            start = time.time()
+            try:
+                resp, content = await self.http.request(uri, **kwargs)
+            except Exception as e:
+                error = e
+            transient = self.scheduler.is_transient(resp, error)
+            self.scheduler.release(not transient)
+            if self.request_hooks:
+                self._call_request_hooks(uri, kwargs, resp, content, time.time() - start, error, attempt)
+
+            delay = self.scheduler.retry_delay(attempt, method, resp, error) if transient else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return resp, content
+            await asyncio.sleep(delay)
+
+    async def authenticate(self, cert, key, session_file=None, session_ttl=3600):
+        """
+        Use the cert/key to authenticate the session, see API.authenticate().
+        """
+        self.client_certificate = (key, cert)
+        self.http.add_certificate(key, cert)
+        self.session_file = session_file
+        self.session_ttl = session_ttl
+
+        if session_file and self._load_session():
+            self.session_cached = True
+        else:
+            await self.__authenticate()
+        self.authenticated = True
+
+        return self.authenticated
+
+    async def __authenticate(self):
+        resp, content = await self._request(self.STARTSSL_AUTHURI, method="GET")
+        self._check_authentication(resp)
+
+    async def __reauthenticate(self, rejected_cookies):
+        if self.__session_lock is None:
+            self.__session_lock = asyncio.Lock()
+        async with self.__session_lock:
+            if self.cookies == rejected_cookies:
+                self.session_cached = False
+                await self.__authenticate()
+
+    async def get_validated_resources(self, force_update=False):
+        """
+        Returns validated resources (emails/domains), see API.get_validated_resources().
+        Both lists are requested concurrently.
+        """
+        assert self.authenticated, "not authenticated"
+        if self.validated_emails is not None and self.validated_domains is not None and not force_update:
+            return self.validated_emails, self.validated_domains
+
+        if self.validated_cache is None:
+            await self.__fetch_validated_resources()
+        elif force_update or not self._load_validated_resources():
+            lock = self.validated_cache.lock()
+            await asyncio.get_event_loop().run_in_executor(None, lock.acquire)  # flock blocks
+            try:
+                if force_update or not self._load_validated_resources():
+                    await self.__fetch_validated_resources()
+                    self._save_validated_resources()
+            finally:
+                lock.release()
+
+        return self.validated_emails, self.validated_domains
+
+    async def __fetch_validated_resources(self):
+        (domains_resp, domains), (emails_resp, emails) = await asyncio.gather(
+            self._request(self._validated_resources_uri(self.STARTSSL_GETDOMAINSURI), method="GET", body=self.VALIDATED_RESOURCES_BODY),
+            self._request(self._validated_resources_uri(self.STARTSSL_GETEMAILSURI), method="GET", body=self.VALIDATED_RESOURCES_BODY))
+        self._set_validated_domains(domains_resp, domains)
+        self._set_validated_emails(emails_resp, emails)
+        self.validated_cached = False
+
+    async def is_validated_domain(self, domain):
+        """
+        Check the validation status of a (sub)domain, see API.is_validated_domain()
+        """
+        await self.get_validated_resources()
+
+        return self.validated_domains_index.lookup(domain) or False
+
+    async def get_certificates_list(self):
+        """
+        Yields the available signed certificates, see API.get_certificates_list().
+        The next page is fetched while the entries of the current page are consumed.
+        """
+        pageindex = 0
+        page = asyncio.ensure_future(self.__get_certificates_page(pageindex))
+        try:
+            while page is not None:
+                content = await page
+                page = None
+                if self._has_next_page(content):
+                    pageindex += 1
+                    page = asyncio.ensure_future(self.__get_certificates_page(pageindex))
+                for cert in self._parse_certificates_page(content):
+                    yield cert
+        finally:
+            if page is not None:
+                page.cancel()
+
+    async def find_certificates(self, keys):
+        """
+        Looks up certificates by name, order number or id, paging stops as soon as all keys have been found,
+        see API.find_certificates().
+        """
+        pending = set(str(key) for key in keys)
+        found = {}
+        certificates = self.get_certificates_list()
+        try:
+            async for cert in certificates:
+                self._match_certificate(cert, pending, found)
+                if not pending:
+                    break
+        finally:
+            await certificates.aclose()
+        return found
+
+    async def __get_certificates_page(self, pageindex):
+        resp, content = await self._request(self._certificates_page_uri(pageindex), method="GET")
+        self._check_certificates_page(resp, content)
+        return content
+
+    async def get_certificate_zip(self, certificate_id):
+        """
+        Returns a the certificate zip bundle, see API.get_certificate_zip().
+        """
+        resp, content = await self._request(self._certificate_zip_uri(certificate_id), method="GET")
+        return self._check_certificate_zip(resp), content
+
+    async def get_certificate(self, certificate_id, target_dir=None):
+        """
+        Returns a certificate, it's basename (Common Name) and the corresponding intermediate certificate,
+        see API.get_certificate().
+        """
+        attachment_filename, zip_file = await self.get_certificate_zip(certificate_id)
+        return self._extract_certificate(attachment_filename, zip_file, target_dir)
+
+    async def get_certificates(self, certificates, jobs=4, store=None):
+        """
+        Retrieves multiple certificates concurrently, see API.get_certificates().
+
+        :param certificates: iterable or async iterable of certificate dicts
+        :param jobs: maximum number of concurrent downloads
+        :param store: optional CertificateStore, stored certificates are taken from it instead of being downloaded
+        :return: async generator of (certificate, result, error) tuples (in input order)
+        """
+        assert jobs > 0, "jobs must be positive"
+        pending = collections.deque()
+
+        async def pop_result():
+            cert, future = pending.popleft()
+            try:
+                return cert, await future, None
+            except Exception as e:
+                return cert, None, e
+
+        if not hasattr(certificates, '__aiter__'):
+            certificates = self.__aiter(certificates)
+        try:
+            async for cert in certificates:
+                stored = store.get(cert['id']) if store is not None else None
+                if stored is not None:
+                    future = asyncio.get_event_loop().create_future()
+                    future.set_result(stored)
+                else:
+                    future = asyncio.ensure_future(self.get_certificate(cert['id']))
+                pending.append((cert, future))
+                while len(pending) >= jobs:
+                    yield await pop_result()
+            while pending:
+                yield await pop_result()
+        finally:
+            for cert, future in pending:
+                future.cancel()
+
+    @staticmethod
+    async def __aiter(iterable):
+        for item in iterable:
+            yield item
+
+    async def check_request_subjects(self, subjects):
+        """
+        Makes sure all subjects of a certificate request are covered by domain validations,
+        see API.check_request_subjects().
+        """
+        await self.get_validated_resources()
+        if self._stale_validations([subjects]):
+            await self.get_validated_resources(force_update=True)
+        return self._check_request_subjects(subjects)
+
+    async def submit_certificate_request(self, profile, csr):
+        """
+        Submits a CSR, see API.submit_certificate_request().
+        """
+        assert profile in self.CERTIFICATE_PROFILES, "unknown profile"
+
+        if profile in ['server', 'xmpp']:
+            subjects = csr.get_subjects()
+            await self.check_request_subjects(subjects)
+            await self.__submit_csr(csr.get_pem(), subjects)
+        else:
+            await self.get_validated_resources()
+
+    async def __submit_csr(self, pem, subjects):
+        resp, content = await self._request(self.STARTSSL_SUBMITCSR, method="POST", body=self._certificate_request_body(pem, subjects))
+        assert resp.status == 302, "CSR req is not redirecting"
+        resp, content = await self._request(self.STARTSSL_BASEURI + resp['location'], method="GET")
+        assert resp.status == 200, "second_step_certs bad status"
+
+    async def submit_certificate_requests(self, profile, csrs, jobs=4, processes=None):
+        """
+        Submits a batch of CSRs, see API.submit_certificate_requests().
+        The CSRs are parsed in a process pool without blocking the event loop.
+        """
+        assert profile in self.CERTIFICATE_PROFILES, "unknown profile"
+        assert jobs > 0, "jobs must be positive"
+        self._check_submission_profile(profile)
+
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(None, self._parse_certificate_requests, csrs, processes)
+        await self.get_validated_resources()
+        if self._stale_validations(result['subjects'] for result in results if result['status'] is None):
+            await self.get_validated_resources(force_update=True)
+        self._check_certificate_requests(results)
+
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def submit(result, pem):
+            async with semaphore:
+                start = time.time()
+                try:
+                    await self.__submit_csr(pem, result['subjects'])
+                    result['status'] = 'submitted'
+                except Exception as e:
+                    result['status'] = 'failed'
+                    result['error'] = str(e) or type(e).__name__
+                result['submit_time'] = time.time() - start
+
+        await asyncio.gather(*[submit(result, pem) for result, (name, pem) in zip(results, csrs)
+                               if result['status'] is None])
+        return results
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        self.http.close()
@@ -0,0 +1,265 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Local server for the StartSSL API (the serve subcommand of startssl.py).
+
+APIServer keeps an authenticated startssl.API instance warm and serves it as JSON over HTTP on a Unix socket
+(accessible by the owner only, there is no further authentication), e.g.:
+
+    curl --unix-socket /run/user/1000/startssl.sock http://localhost/certificates/www.example.com
+
+License: LGPL 2.1 or later, see startssl.py
+"""
+
+import json
+import os
+import socket
+import stat
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler  # python 3
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler  # python 2
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlsplit, parse_qs
+
+from startssl import Certificate, __version__
+
+
+def _json_default(value):
+    """
+    JSON encoding of certificate entries and dates
+    """
+    if isinstance(value, Certificate):
+        return value.to_json()
+    return value.isoformat()
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of APIServer:
+
+    GET  /certificates[?refresh=1]                   certificate list (newest order first)
+    GET  /certificates/<id, order number or name>    certificate and intermediate certificate (PEM)
+    GET  /validated[?refresh=1]                      validated domains and emails
+    POST /csr                                        submit CSRs, body: {"profile": "server", "csrs": [{"name": ..., "csr": PEM}]}
+    GET  /status                                     server status
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive
+    server_version = "StartSSL_API/" + __version__
+
+    def address_string(self):
+        return "unix"  # Unix socket clients have no address
+
+    def log_message(self, format, *args):
+        if self.server.api_server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        try:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self.close_connection = True  # the body can't be skipped
+                raise ValueError("invalid Content-Length")
+            body = self.rfile.read(length)
+            status, data = self.server.api_server.handle(method, url.path, parse_qs(url.query), body)
+        except ValueError as e:
+            status, data = 400, {'error': str(e)}
+        except Exception as e:
+            status, data = 502, {'error': str(e) or type(e).__name__}
+
+        content = json.dumps(data, indent=2, sort_keys=True, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class APIServer(object):
+    """
+    Serves an authenticated API instance to local clients (JSON over HTTP on a Unix socket).
+
+    The API instance stays warm: connections, session, validated resources, the certificate list and downloaded
+    certificates are reused between requests. The certificate list and validated resources are refreshed after ttl
+    seconds (or on request), requests are handled concurrently.
+    """
+    MISS_REFRESH_INTERVAL = 10  # seconds, lookups of unknown certificates refresh the list at most this often
+
+    def __init__(self, api, address, index=None, ttl=300, jobs=4, verbose=False):
+        """
+        :param api: authenticated API instance
+        :param address: path of the Unix socket (created accessible by the owner only)
+        :param index: optional CertificateIndex, the certificate list is synced incrementally and saved there
+        :param ttl: seconds the certificate list and the validated resources are cached
+        :param jobs: maximum number of concurrent CSR submissions per request
+        :param verbose: log each request to stderr
+        :raises ValueError: if address is in use (a running server) or another kind of file
+        """
+        self.api = api
+        self.address = address
+        self.index = index
+        self.ttl = ttl
+        self.jobs = jobs
+        self.verbose = verbose
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.certificates = None
+        self.certificates_by_key = {}  # id, order number and name (newest order) -> certificate
+        self.certificates_time = 0
+        self.validated_time = 0
+        self.downloads = {}  # id -> certificate, certificates don't change once issued
+
+        if os.path.lexists(address):
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise ValueError("%s exists and isn't a socket" % address)
+            if self._socket_in_use(address):
+                raise ValueError("%s is in use by a running server" % address)
+            os.unlink(address)  # stale socket of a previous run
+        umask = os.umask(0o077)
+        try:
+            self.httpd = _ThreadingUnixHTTPServer(address, APIRequestHandler)
+        finally:
+            os.umask(umask)
+        self.httpd.api_server = self
+
+    @staticmethod
+    def _socket_in_use(address):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def serve_forever(self):
+        """
+        Handles requests until shutdown() is called (from another thread) or KeyboardInterrupt
+        """
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+    def close(self):
+        self.httpd.server_close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def handle(self, method, path, query, body):
+        """
+        Handles a request.
+
+        :return: HTTP status, JSON serializable data
+        :raises ValueError: on invalid requests
+        """
+        refresh = query.get('refresh', ["0"])[0] not in ("", "0")
+        parts = [part for part in path.split("/") if part]
+        if method == "GET" and parts == ["certificates"]:
+            return 200, self.get_certificates_list(refresh)
+        if method == "GET" and len(parts) == 2 and parts[0] == "certificates":
+            cert = self.find_certificate(parts[1])
+            if cert is None:
+                return 404, {'error': "unknown certificate %s" % parts[1]}
+            return 200, self.get_certificate(cert)
+        if method == "GET" and parts == ["validated"]:
+            return 200, self.get_validated_resources(refresh)
+        if method == "POST" and parts == ["csr"]:
+            return 200, self.submit_certificate_requests(body)
+        if method == "GET" and parts == ["status"]:
+            return 200, {'version': __version__, 'uptime': time.time() - self.started,
+                         'certificates': len(self.certificates or ()), 'downloads': len(self.downloads)}
+        return 404, {'error': "unknown endpoint %s %s" % (method, path)}
+
+    def get_certificates_list(self, refresh=False, max_age=None):
+        """
+        :param refresh: refresh the certificate list now
+        :param max_age: refresh the certificate list if it's older (seconds, default: ttl)
+        """
+        with self.lock:
+            max_age = self.ttl if max_age is None else max_age
+            if refresh or self.certificates is None or time.time() - self.certificates_time > max_age:
+                certs = self.api.get_certificates_list()
+                if self.index is not None:
+                    self.index.sync(certs)
+                    self.index.save()
+                    certs = iter(self.index)
+                self.certificates = list(certs)
+                by_key = {}
+                for cert in reversed(self.certificates):  # the newest order of a name wins
+                    by_key[cert['id']] = by_key[str(cert['order_number'])] = by_key[cert['name']] = cert
+                self.certificates_by_key = by_key
+                self.certificates_time = time.time()
+            return self.certificates
+
+    def find_certificate(self, key):
+        """
+        Looks up a certificate by id, order number or name (newest order).
+        If it's unknown (e.g. a new order), the list is refreshed unless that happened within MISS_REFRESH_INTERVAL,
+        so repeated lookups of unknown keys don't page the whole list (and block other clients) each time.
+        """
+        self.get_certificates_list()
+        cert = self.certificates_by_key.get(key)
+        if cert is None:
+            self.get_certificates_list(max_age=self.MISS_REFRESH_INTERVAL)
+            cert = self.certificates_by_key.get(key)
+        return cert
+
+    def get_certificate(self, cert):
+        certificate = self.downloads.get(cert['id'])
+        if certificate is None:
+            basename, certificate, intermediate_cert = self.api.get_certificate(cert['id'])
+            certificate = self.downloads[cert['id']] = {
+                'id': cert['id'], 'order_number': cert['order_number'], 'name': basename,
+                'certificate': certificate, 'intermediate_certificate': intermediate_cert,
+            }
+        return certificate
+
+    def get_validated_resources(self, refresh=False):
+        with self.lock:
+            force_update = refresh or time.time() - self.validated_time > self.ttl
+            self.api.get_validated_resources(force_update=force_update)
+            if force_update:
+                self.validated_time = time.time()
+            return {'domains': self.api.validated_domains, 'emails': self.api.validated_emails}
+
+    def submit_certificate_requests(self, body):
+        try:
+            request = json.loads(body.decode('utf-8'))
+            profile = request.get('profile', "server")
+            csrs = [(csr.get('name', "csr%d" % i), csr['csr']) for i, csr in enumerate(request['csrs'])]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError("invalid request: %s" % (e, ))
+        if profile not in ('server', 'xmpp'):
+            raise ValueError("unsupported profile %s" % profile)
+
+        self.get_validated_resources()
+        results = self.api.submit_certificate_requests(profile, csrs, jobs=self.jobs, processes=1)
+        with self.lock:
+            self.certificates_time = 0  # the new orders are listed on the next request
+        return results
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
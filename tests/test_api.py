@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+
+"""
+API against the local fake StartSSL server (benchmarks/fake_server.py).
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import pytest
+
+import startssl
+import synthetic
+from fake_server import FakeStartSSL
+
+
+@pytest.fixture
+def server():
+    server = FakeStartSSL(pages=1, rows_per_page=1).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def api(server):
+    api = server.configure(startssl.API(ca_certs=None))
+    api.authenticate(__file__, __file__)  # the client certificate isn't used over plain HTTP
+    return api
+
+
+def test_submit_certificate_requests_reports_invalid_csrs(server, api):
+    csrs = [("valid", synthetic.CSR), ("no cn", synthetic.CSR_WITHOUT_CN), ("garbage", "not a CSR")]
+    results = api.submit_certificate_requests('server', csrs, processes=1)
+
+    assert [result['status'] for result in results] == ['submitted', 'invalid', 'invalid']
+    assert "no common name" in results[1]['error']
+    assert server.posts == ["/Certificates/ssl"]
+
+
+def test_submit_certificate_requests_rejects_unsupported_profiles(server, api):
+    with pytest.raises(ValueError):
+        api.submit_certificate_requests('smime', [("valid", synthetic.CSR)], processes=1)
+    assert server.posts == []
+
+
+def test_metrics_count_the_transferred_bytes(api):
+    metrics = startssl.Metrics()
+    api.add_request_hook(metrics)
+    assert len(list(api.get_certificates_list())) == 1
+
+    certlist = [m for endpoint, m in metrics.snapshot().items() if endpoint.endswith("/CertList")][0]
+    assert 0 < certlist['bytes_received'] < certlist['bytes_decoded']  # the fake server compresses the HTML pages
+    assert certlist['compressed'] == 1
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+
+"""
+AsyncAPI against the local fake StartSSL server (benchmarks/fake_server.py).
+"""
+
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import startssl
+import synthetic
+from fake_server import FakeStartSSL
+from startssl_async import AsyncAPI
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine) if sys.version_info < (3, 7) else asyncio.run(coroutine)
+
+
+def test_submit_certificate_request():
+    server = FakeStartSSL(pages=1, rows_per_page=1).start()
+    try:
+        async def submit():
+            api = server.configure(AsyncAPI(ca_certs=None))
+            try:
+                await api.authenticate(__file__, __file__)  # the client certificate isn't used over plain HTTP
+                await api.submit_certificate_request('server', startssl.CSR(synthetic.CSR))
+            finally:
+                api.close()
+
+        run(submit())
+        assert server.posts == ["/Certificates/ssl"]
+    finally:
+        server.stop()
@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Incremental sync of CertificateIndex.
+"""
+
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startssl import Certificate, CertificateIndex
+
+
+def certificate(order_number, status="Issued"):
+    issued = status != "Pending"
+    return Certificate(id="id%d" % order_number if issued else None, order_number=order_number,
+                       name="host%d.example.com" % order_number, status=status,
+                       expiry_date=datetime.date(2017, 1, 1) if issued else None)
+
+
+class Listing(object):
+    """
+    Certificate list iterator which counts the consumed entries
+    """
+
+    def __init__(self, certificates):
+        self.certificates = iter(certificates)
+        self.consumed = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cert = next(self.certificates)
+        self.consumed += 1
+        return cert
+
+    next = __next__  # python 2
+
+
+def test_sync_stops_at_first_known_order(tmpdir):
+    index = CertificateIndex(str(tmpdir.join("certificates.json")))
+    assert index.sync(Listing([certificate(n) for n in range(100, 90, -1)])) == 10
+
+    listing = Listing([certificate(n) for n in range(102, 90, -1)])
+    assert index.sync(listing) == 2
+    assert listing.consumed == 3
+    assert [cert['order_number'] for cert in index][:3] == [102, 101, 100]
+
+
+def test_sync_revisits_older_pending_orders(tmpdir):
+    index = CertificateIndex(str(tmpdir.join("certificates.json")))
+    index.sync(Listing([certificate(101, "Pending"), certificate(100, "Pending"), certificate(99)]))
+    index.sync(Listing([certificate(101), certificate(100, "Pending"), certificate(99)]))
+    index.sync(Listing([certificate(101), certificate(100), certificate(99)]))
+
+    assert index.lookup("100")['status'] == "Issued"
+    assert index.lookup("100")['id'] == "id100"
+
+    listing = Listing([certificate(102), certificate(101), certificate(100), certificate(99)])
+    index.sync(listing)
+    assert listing.consumed == 2  # nothing pending anymore
+
+
+def test_sync_drops_pending_orders_which_are_no_longer_listed(tmpdir):
+    index = CertificateIndex(str(tmpdir.join("certificates.json")))
+    index.sync(Listing([certificate(101), certificate(100, "Pending"), certificate(99)]))
+    index.sync(Listing([certificate(101), certificate(99)]))
+    assert index.lookup("100") is None
+    assert len(index) == 2
+
+
+def test_only_issued_entries_are_final(tmpdir):
+    index = CertificateIndex(str(tmpdir.join("certificates.json")))
+    index.sync(Listing([certificate(101, "Pending"), certificate(100), certificate(99, "Rejected")]))
+    assert not index.is_final(index.lookup("101"))
+    assert not index.is_final(index.lookup("host101.example.com"))
+    assert index.is_final(index.lookup("id100"))
+    assert index.is_final(index.lookup("99"))
+    assert not index.is_final(index.lookup("98"))  # unknown
+
+
+def test_corrupt_index_is_empty(tmpdir):
+    path = tmpdir.join("certificates.json")
+    path.write('{"version": 1, "certif')
+    index = CertificateIndex(str(path))
+    assert len(index) == 0
+    index.sync([certificate(1)])
+    index.save()
+    assert len(CertificateIndex(str(path))) == 1
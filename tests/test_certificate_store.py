@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Content addressed certificate store (CertificateStore).
+"""
+
+import base64
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startssl import CertificateStore
+
+
+def pem(der):
+    return "-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n" % base64.b64encode(der).decode('ascii')
+
+
+CERTIFICATE_1 = pem(b"certificate 1")
+CERTIFICATE_2 = pem(b"certificate 2")
+INTERMEDIATE = pem(b"intermediate")
+
+
+def order(order_number):
+    return {'id': "id%d" % order_number, 'order_number': order_number, 'name': "host%d.example.com" % order_number}
+
+
+def objects(path):
+    return sorted(name for directory, subdirectories, names in os.walk(str(path.join("objects"))) for name in names)
+
+
+def test_round_trip(tmpdir):
+    store = CertificateStore(str(tmpdir))
+    fingerprint = store.add(order(1), CERTIFICATE_1, INTERMEDIATE)
+    store.add(order(2), CERTIFICATE_2, INTERMEDIATE)
+    store.save()
+
+    assert fingerprint == hashlib.sha256(b"certificate 1").hexdigest()
+    assert len(objects(tmpdir)) == 3  # the shared intermediate certificate is stored once
+
+    store = CertificateStore(str(tmpdir))
+    assert len(store) == 2 and "id1" in store
+    assert store.get("id1") == ("host1.example.com", CERTIFICATE_1, INTERMEDIATE)
+    assert store.get("id3") is None
+    assert store.find(fingerprint.upper()) == "id1"
+
+
+def test_damaged_objects_count_as_missing_and_are_repaired(tmpdir):
+    store = CertificateStore(str(tmpdir))
+    fingerprint = store.add(order(1), CERTIFICATE_1, INTERMEDIATE)
+    path = tmpdir.join("objects", fingerprint[:2], fingerprint + ".pem")
+
+    path.write(CERTIFICATE_2)
+    assert store.get("id1") is None
+    path.write("garbage")
+    assert store.get("id1") is None
+    path.remove()
+    assert store.get("id1") is None
+
+    store.add(order(1), CERTIFICATE_1, INTERMEDIATE)
+    assert store.get("id1") == ("host1.example.com", CERTIFICATE_1, INTERMEDIATE)
+
+
+def test_corrupt_index_is_empty(tmpdir):
+    store = CertificateStore(str(tmpdir))
+    store.add(order(1), CERTIFICATE_1, INTERMEDIATE)
+    store.save()
+    tmpdir.join("orders.json").write('{"vers')
+
+    store = CertificateStore(str(tmpdir))
+    assert len(store) == 0
+    store.add(order(1), CERTIFICATE_1, INTERMEDIATE)
+    assert store.get("id1") is not None
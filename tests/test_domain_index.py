@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Validated domain lookups of DomainIndex.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startssl import DomainIndex
+
+
+def test_lookup_matches_on_label_boundaries():
+    index = DomainIndex(["example.com"])
+    assert index.lookup("example.com") == "example.com"
+    assert index.lookup("www.example.com") == "example.com"
+    assert index.lookup("evilexample.com") is None
+    assert index.lookup("example.com.evil.org") is None
+    assert index.lookup("com") is None
+    assert "a.b.example.com" in index
+    assert "evilexample.com" not in index
+
+
+def test_lookup_prefers_the_most_specific_domain():
+    index = DomainIndex(["example.com", "dev.example.com"])
+    assert index.lookup("www.dev.example.com") == "dev.example.com"
+    assert index.lookup("dev.example.com") == "dev.example.com"
+    assert index.lookup("www.example.com") == "example.com"
+
+
+def test_lookup_normalizes_names():
+    index = DomainIndex(["Example.COM"])
+    assert index.lookup("WWW.example.com.") == "Example.COM"  # the domain is returned as validated
+
+
+def test_lookup_many():
+    index = DomainIndex(["example.com", "example.org"])
+    assert index.lookup_many(["example.com", "mail.example.org", "example.net"]) == {
+        "example.com": "example.com", "mail.example.org": "example.org", "example.net": None}
+    assert len(index) == 2
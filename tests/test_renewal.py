@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Renewal planning (RenewalPlanner) and the daily renewal budget (RenewalBudget).
+"""
+
+import datetime
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import startssl
+import synthetic
+from startssl import Certificate, RenewalBudget, RenewalPlanner
+
+TODAY = datetime.date(2016, 6, 1)
+
+
+def certificate(order_number, name, expiry_date, status="Issued", profile="server"):
+    return Certificate(id="id%d" % order_number, order_number=order_number, name=name, profile=profile,
+                       status=status, expiry_date=expiry_date)
+
+
+def days(n):
+    return TODAY + datetime.timedelta(days=n)
+
+
+def order_numbers(certificates):
+    return [cert['order_number'] for cert in certificates]
+
+
+def test_due_bounds():
+    planner = RenewalPlanner([
+        certificate(1, "expired.example.com", days(-10)),
+        certificate(2, "today.example.com", days(0)),
+        certificate(3, "horizon.example.com", days(30)),
+        certificate(4, "later.example.com", days(31)),
+    ])
+    assert order_numbers(planner.due(30, today=TODAY)) == [1, 2, 3]  # already expired and the horizon day included
+    assert order_numbers(planner.due(0, today=TODAY)) == [1, 2]
+    assert order_numbers(planner.due(-11, today=TODAY)) == []
+
+
+def test_due_orders_by_expiry():
+    planner = RenewalPlanner([certificate(1, "b.example.com", days(5)), certificate(2, "a.example.com", days(1)),
+                              certificate(3, "c.example.com", days(5))])
+    assert order_numbers(planner.due(10, today=TODAY)) == [2, 1, 3]
+
+
+def test_expiring_between_is_inclusive():
+    planner = RenewalPlanner([certificate(n, "host%d.example.com" % n, days(n)) for n in range(10)])
+    assert order_numbers(planner.expiring_between(days(2), days(4))) == [2, 3, 4]
+    assert order_numbers(planner.expiring_between(days(20), days(30))) == []
+
+
+def test_only_the_newest_order_per_name_and_profile_counts():
+    planner = RenewalPlanner([
+        certificate(1, "www.example.com", days(1)),
+        certificate(5, "WWW.example.com.", None, status="Pending"),  # renewed, not issued yet
+        certificate(2, "mail.example.com", days(1)),
+        certificate(3, "mail.example.com", days(300)),
+        certificate(4, "mail.example.com", days(2), profile="xmpp"),
+        certificate(6, "revoked.example.com", days(1), status="Revoked"),
+    ])
+    assert order_numbers(planner.due(30, today=TODAY)) == [4]
+    assert len(planner) == 2
+
+
+def test_match_csrs_by_common_name():
+    csr = startssl.CSR(synthetic.CSR)  # www.example.com
+    csr_without_cn = startssl.CSR(synthetic.CSR_WITHOUT_CN)
+    certificates = [certificate(1, "WWW.Example.com", days(1)), certificate(2, "mail.example.com", days(1))]
+    assert RenewalPlanner.match_csrs(certificates, [csr_without_cn, csr]) == [
+        (certificates[0], csr), (certificates[1], None)]
+
+
+def test_budget(tmpdir):
+    path = str(tmpdir.join("renewals.json"))
+    budget = RenewalBudget(path, 3)
+    assert budget.remaining() == 3
+    budget.spend(2)
+    budget.save()
+
+    budget = RenewalBudget(path, 3)  # a later run on the same day
+    assert budget.remaining() == 1
+    budget.spend()
+    assert budget.remaining() == 0
+    assert RenewalBudget(path, 0).remaining() is None  # unlimited
+
+
+def test_budget_resets_on_the_next_day(tmpdir):
+    path = tmpdir.join("renewals.json")
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    path.write(json.dumps({'day': yesterday.isoformat(), 'submitted': 3}))
+    assert RenewalBudget(str(path), 3).remaining() == 3
+
+
+def test_corrupt_budget_counts_as_nothing_submitted(tmpdir):
+    path = tmpdir.join("renewals.json")
+    path.write('{"day": "20')
+    budget = RenewalBudget(str(path), 3)
+    assert budget.remaining() == 3
+    budget.spend()
+    budget.save()
+    assert RenewalBudget(str(path), 3).remaining() == 2
@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Classification of failed requests by RequestScheduler.
+"""
+
+import errno
+import os
+import socket
+import ssl
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httplib2
+import startssl
+
+
+def test_transient_errors_are_retried():
+    scheduler = startssl.RequestScheduler(retries=4)
+    for error in [socket.timeout(), socket.error(errno.ECONNRESET, "reset"), socket.error(errno.EPIPE, "broken pipe")]:
+        assert scheduler.is_transient(error=error), error
+        assert scheduler.retry_delay(1, "GET", error=error) is not None, error
+
+
+def test_permanent_errors_are_raised():
+    scheduler = startssl.RequestScheduler(retries=4)
+    errors = [socket.error(errno.ECONNREFUSED, "refused"), ssl.SSLError(1, "CERTIFICATE_VERIFY_FAILED"),
+              httplib2.ServerNotFoundError("unknown host"), httplib2.RelativeURIError("relative")]
+    if hasattr(ssl, 'SSLCertVerificationError'):
+        errors.append(ssl.SSLCertVerificationError(1, "certificate verify failed"))
+    for error in errors:
+        assert not scheduler.is_transient(error=error), error
+        assert scheduler.retry_delay(1, "GET", error=error) is None, error
@@ -0,0 +1,104 @@
+# -*- coding: UTF-8 -*-
+
+"""
+APIServer (serve subcommand) on a Unix socket, backed by the local fake StartSSL server.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import pytest
+
+import startssl
+from fake_server import FakeStartSSL
+from startssl_server import APIServer
+
+
+@pytest.fixture
+def api():
+    server = FakeStartSSL(pages=1, rows_per_page=3).start()
+    api = server.configure(startssl.API(ca_certs=None))
+    api.authenticate(__file__, __file__)  # the client certificate isn't used over plain HTTP
+    yield api
+    server.stop()
+
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return str(tmpdir.join("startssl.sock"))
+
+
+def serve(api, socket_path):
+    server = APIServer(api, socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def request(socket_path, raw):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(raw)
+        response = b""
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+    finally:
+        sock.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split(b" ")[1]), json.loads(body.decode('utf-8'))
+
+
+def test_requests(api, socket_path):
+    server = serve(api, socket_path)
+    try:
+        status, data = request(socket_path, b"GET /certificates/2 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        assert status == 200 and data['order_number'] == 2
+
+        status, data = request(socket_path, b"POST /csr HTTP/1.1\r\nHost: localhost\r\nContent-Length: x\r\n\r\n{}")
+        assert status == 400 and "Content-Length" in data['error']
+    finally:
+        server.shutdown()
+
+
+def test_refuses_to_replace_other_files(api, socket_path):
+    with open(socket_path, 'w') as f:
+        f.write("not a socket")
+    with pytest.raises(ValueError):
+        APIServer(api, socket_path)
+    assert os.path.exists(socket_path)
+
+
+def test_refuses_to_replace_the_socket_of_a_running_server(api, socket_path):
+    server = serve(api, socket_path)
+    try:
+        with pytest.raises(ValueError):
+            APIServer(api, socket_path)
+        status, data = request(socket_path, b"GET /status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        assert status == 200
+    finally:
+        server.shutdown()
+
+
+def test_replaces_stale_sockets(api, socket_path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()  # the socket file stays, nobody listens
+
+    server = serve(api, socket_path)
+    try:
+        status, data = request(socket_path, b"GET /status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        assert status == 200
+    finally:
+        server.shutdown()